@@ -0,0 +1,62 @@
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+
+def make_catalogue(size: int, unmapped_ratio: float = 0.0, seed: int = 1) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Returns (SmartKasa inventory, Syrve nomenclature products) for `size` products. The SmartKasa alter_number
+    matches the Syrve code, except for roughly `unmapped_ratio` of the products, which have no Syrve counterpart.
+    """
+    rnd = random.Random(seed)
+    smartkasa_products, syrve_products = [], []
+    for i in range(size):
+        code = f"A{i:06d}"
+        smartkasa_products.append({
+            "id": str(100000 + i),
+            "alter_number": code,
+            "alter_title": f"Product {i}",
+            "price": round(rnd.uniform(10, 500), 2)
+        })
+        if rnd.random() >= unmapped_ratio:
+            syrve_products.append({
+                "id": f"00000000-0000-4000-8000-{i:012d}",
+                "code": code,
+                "name": f"Product {i}",
+                "type": "Dish"
+            })
+    return smartkasa_products, syrve_products
+
+
+def make_receipts(count: int,
+                  catalogue: List[Dict],
+                  start: datetime,
+                  items_per_receipt: Tuple[int, int] = (1, 6),
+                  discount_ratio: float = 0.2,
+                  seed: int = 2) -> Iterator[Dict]:
+    """Yields `count` closed SmartKasa receipts in created_at order, one every 1-120 seconds from `start`."""
+    rnd = random.Random(seed)
+    created = start
+    for i in range(count):
+        created += timedelta(seconds=rnd.randint(1, 120))
+        items = []
+        for product in rnd.sample(catalogue, min(len(catalogue), rnd.randint(*items_per_receipt))):
+            items.append({
+                "product_id": product["id"],
+                "quantity": rnd.randint(1, 3),
+                "price": product["price"]
+            })
+        total = round(sum(item["quantity"] * item["price"] for item in items), 2)
+        discount = round(total * 0.1, 2) if rnd.random() < discount_ratio else 0
+        yield {
+            "id": f"bench-{i:08d}",
+            "created_at": created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "state": "closed",
+            "total_amount": str(total - discount),
+            "discount_amount": str(discount),
+            "items": items,
+            "payment_transactions": [{
+                "transaction_type_id": rnd.randint(0, 1),
+                "amount": str(total - discount)
+            }]
+        }
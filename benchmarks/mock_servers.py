@@ -0,0 +1,249 @@
+import json
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from benchmarks.generators import make_catalogue, make_receipts
+
+
+class BenchmarkServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 resets connections as soon as a few page/order workers connect at once
+    request_queue_size = 256
+
+    def __init__(self, handler, latency: float, error_rate: float, seed: int):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def should_fail(self, endpoint: str) -> bool:
+        with self._lock:
+            self.calls[endpoint] += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors[endpoint] += 1
+            return failed
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Shared plumbing: per-request latency, random 503s and call counters, keyed by endpoint (ids stripped)."""
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes: with Nagle on, the body waits for the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status: int, body) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def handle_request(self, method: str) -> None:
+        url = urlparse(self.path)
+        if url.path == "/__stats":
+            return self.send_json(200, {"calls": self.server.calls, "errors": self.server.errors})
+
+        body = self.read_json() if method == "POST" else {}
+        endpoint = self.endpoint(url.path)
+        if self.server.latency:
+            time.sleep(max(0.0, random.gauss(self.server.latency, self.server.latency * 0.2)))
+        if self.server.should_fail(endpoint):
+            return self.send_json(503, {"error": "injected failure"})
+        self.route(method, url.path, parse_qs(url.query), body)
+
+    def endpoint(self, path: str) -> str:
+        return path
+
+    def route(self, method: str, path: str, query: Dict[str, List[str]], body: dict) -> None:
+        raise NotImplementedError
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+
+class SmartKasaHandler(MockHandler):
+    receipts: List[Dict] = []
+    products: List[Dict] = []
+    products_by_id: Dict[str, Dict] = {}
+    page_size = 50
+
+    def endpoint(self, path: str) -> str:
+        if path.startswith("/api/v1/inventory/products/"):
+            return "/api/v1/inventory/products/{id}"
+        return path
+
+    def page(self, items: List[Dict], query: Dict[str, List[str]]) -> None:
+        page = int(query.get("page", ["1"])[0])
+        total_pages = max(1, (len(items) + self.page_size - 1) // self.page_size)
+        self.send_json(200, {
+            "data": items[(page - 1) * self.page_size:page * self.page_size],
+            "meta": {"total_pages": total_pages, "next_page": page + 1 if page < total_pages else None}
+        })
+
+    def route(self, method, path, query, body):
+        if path == "/api/v1/auth/sessions" and method == "POST":
+            return self.send_json(201, {"data": {"access": uuid.uuid4().hex}})
+        if path == "/api/v1/pos/receipts":
+            date_start = (query.get("date_start") or [""])[0]
+            date_end = (query.get("date_end") or [""])[0]
+            receipts = [
+                receipt for receipt in self.receipts
+                if receipt["created_at"][:10] >= date_start and (not date_end or receipt["created_at"][:10] <= date_end)
+            ]
+            return self.page(receipts, query)
+        if path == "/api/v1/inventory/products":
+            return self.page(self.products, query)
+        if path.startswith("/api/v1/inventory/products/"):
+            product_id = path.rsplit("/", 1)[1]
+            product = self.products_by_id.get(product_id)
+            return self.send_json(200, {"data": product}) if product else self.send_json(404, {"error": "not found"})
+        self.send_json(404, {"error": "unknown endpoint"})
+
+
+class SyrveHandler(MockHandler):
+    products: List[Dict] = []
+    revision = 1
+    # Seconds a command stays InProgress before commands/status reports Success
+    command_delay = 0.0
+    commands: Dict[str, float] = {}
+
+    def new_command(self) -> str:
+        correlation_id = str(uuid.uuid4())
+        self.commands[correlation_id] = time.monotonic() + self.command_delay
+        return correlation_id
+
+    def route(self, method, path, query, body):
+        path = path[len("/api/1/"):] if path.startswith("/api/1/") else path
+        if path == "access_token":
+            return self.send_json(200, {"token": uuid.uuid4().hex})
+        if path == "organizations":
+            return self.send_json(200, {"organizations": [{"id": "bench-org"}]})
+        if path == "terminal_groups":
+            return self.send_json(200, {"terminalGroups": [{"items": [{"id": "bench-terminal"}]}]})
+        if path == "nomenclature":
+            if body.get("startRevision") is not None and body["startRevision"] >= self.revision:
+                return self.send_json(200, {"revision": self.revision})
+            return self.send_json(200, {"revision": self.revision, "products": self.products, "groups": []})
+        if path == "order/create":
+            return self.send_json(200, {
+                "correlationId": self.new_command(),
+                "orderInfo": {"id": str(uuid.uuid4()), "timestamp": int(time.time() * 1000), "creationStatus": "InProgress"}
+            })
+        if path in ("order/add_payments", "order/close"):
+            return self.send_json(200, {"correlationId": self.new_command()})
+        if path == "commands/status":
+            ready_at = self.commands.get(body.get("correlationId"))
+            if ready_at is None:
+                return self.send_json(200, {"state": "Error", "exception": {"message": "unknown correlationId"}})
+            return self.send_json(200, {"state": "Success" if time.monotonic() >= ready_at else "InProgress"})
+        self.send_json(404, {"error": "unknown endpoint"})
+
+
+def _serve(config: dict, ready) -> None:
+    smartkasa_products, syrve_products = make_catalogue(config["catalogue_size"], config["unmapped_ratio"], seed=config["seed"])
+    start = datetime.fromisoformat(config["start_date"])
+    receipts = list(make_receipts(config["receipts"], smartkasa_products, start, seed=config["seed"] + 1))
+
+    smartkasa_handler = type("BenchSmartKasaHandler", (SmartKasaHandler,), {
+        "receipts": receipts,
+        "products": smartkasa_products,
+        "products_by_id": {product["id"]: product for product in smartkasa_products},
+        "page_size": config["page_size"]
+    })
+    syrve_handler = type("BenchSyrveHandler", (SyrveHandler,), {
+        "products": syrve_products,
+        "command_delay": config["command_delay"],
+        "commands": {}
+    })
+
+    servers = [
+        BenchmarkServer(smartkasa_handler, config["latency"], config["error_rate"], seed=config["seed"]),
+        BenchmarkServer(syrve_handler, config["latency"], config["error_rate"], seed=config["seed"] + 2),
+    ]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    ready.send([f"http://127.0.0.1:{server.server_port}" for server in servers])
+    threading.Event().wait()
+
+
+class MockServers:
+    """
+    SmartKasa and Syrve stand-ins running in a child process, so their memory does not count towards the
+    benchmarked process' RSS. Every request sleeps ~latency seconds and fails with 503 with probability error_rate.
+    """
+
+    def __init__(self,
+                 receipts: int = 1000,
+                 catalogue_size: int = 5000,
+                 unmapped_ratio: float = 0.02,
+                 latency: float = 0.02,
+                 error_rate: float = 0.0,
+                 command_delay: float = 0.0,
+                 page_size: int = 50,
+                 start_date: str = "2025-06-01T00:00:00",
+                 seed: int = 1):
+        self.config = {
+            "receipts": receipts,
+            "catalogue_size": catalogue_size,
+            "unmapped_ratio": unmapped_ratio,
+            "latency": latency,
+            "error_rate": error_rate,
+            "command_delay": command_delay,
+            "page_size": page_size,
+            "start_date": start_date,
+            "seed": seed,
+        }
+        self.smartkasa_url = self.syrve_url = None
+        self._process = None
+
+    def start(self) -> Tuple[str, str]:
+        """Returns (SmartKasa base URL, Syrve base URL)."""
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(self.config, child), daemon=True)
+        self._process.start()
+        self.smartkasa_url, self.syrve_url = parent.recv()
+        return self.smartkasa_url, self.syrve_url
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """Calls and injected errors per endpoint: {"smartkasa": {"calls": ..., "errors": ...}, "syrve": {...}}."""
+        return {
+            "smartkasa": requests.get(f"{self.smartkasa_url}/__stats").json(),
+            "syrve": requests.get(f"{self.syrve_url}/__stats").json(),
+        }
+
+    def stop(self) -> None:
+        if self._process:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,185 @@
+"""
+End-to-end SyncBridge benchmark against local SmartKasa/Syrve stand-ins.
+
+    python -m benchmarks.run --receipts 2000 --catalogue 5000 --latency 0.02
+    python -m benchmarks.run --mode backfill --error-rate 0.01 --json results.json
+
+Every run uses a fresh temporary SQLite database and never touches the real APIs.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def configure_environment(args, smartkasa_url: str, syrve_url: str, db_path: str) -> None:
+    """Must run before the services are imported: they read their settings at import time."""
+    os.environ["SMARTKASA_BASE_URL"] = smartkasa_url
+    os.environ["SYRVE_BASE_URL"] = f"{syrve_url}/api/1"
+    os.environ["SYNCBRIDGE_DB_PATH"] = db_path
+    os.environ["SYNC_START_DATE"] = args.start_date[:10]
+    os.environ["RECEIPTS_ARCHIVE_PATH"] = ""
+    os.environ["SYNC_WORKERS"] = str(args.workers)
+    os.environ["SYRVE_ORDER_CONCURRENCY"] = str(args.workers)
+    os.environ["BACKFILL_CONCURRENCY"] = str(args.workers)
+    os.environ.setdefault("LOG_CONSOLE_LEVEL", "WARNING")
+    os.environ.setdefault("SYRVE_COMMAND_POLL_INITIAL", "0.05")
+    os.environ.setdefault("HTTP_BACKOFF_BASE", "0.05")
+    os.environ.setdefault("PRODUCT_CACHE_WARM_UP", "true")
+    # The report below prints the table once the run is finished
+    os.environ.setdefault("METRICS_SUMMARY", "false")
+
+    from core.config import load_config
+    load_config()
+
+
+class WriteCounter:
+    """Counts INSERT/UPDATE/DELETE statements going through a peewee database."""
+
+    def __init__(self, database):
+        self.writes = 0
+        self._lock = threading.Lock()
+        execute_sql = database.execute_sql
+
+        def counting_execute_sql(sql, *args, **kwargs):
+            if sql.lstrip()[:7].upper() in ("INSERT ", "UPDATE ", "DELETE ", "REPLACE"):
+                with self._lock:
+                    self.writes += 1
+            return execute_sql(sql, *args, **kwargs)
+
+        database.execute_sql = counting_execute_sql
+
+
+def run(args) -> Dict:
+    from benchmarks.mock_servers import MockServers
+
+    servers = MockServers(
+        receipts=args.receipts,
+        catalogue_size=args.catalogue,
+        unmapped_ratio=args.unmapped_ratio,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        command_delay=args.command_delay,
+        page_size=args.page_size,
+        start_date=args.start_date,
+        seed=args.seed
+    )
+    with servers, tempfile.TemporaryDirectory() as tmp:
+        configure_environment(args, servers.smartkasa_url, servers.syrve_url, os.path.join(tmp, "bench.db"))
+
+        from services.DBService import Receipt, db, init_db
+        from services.SyncBridge import SyncBridge
+
+        latencies: List[float] = []
+        latencies_lock = threading.Lock()
+
+        def timed(func):
+            def wrapper(*a, **kw):
+                started = time.perf_counter()
+                try:
+                    return func(*a, **kw)
+                finally:
+                    with latencies_lock:
+                        latencies.append(time.perf_counter() - started)
+            return wrapper
+
+        class BenchmarkBridge(SyncBridge):
+            _process_receipt = timed(SyncBridge._process_receipt)
+            _submit_order_inline = timed(SyncBridge._submit_order_inline)
+
+        init_db()
+        writes = WriteCounter(db)
+        bridge = BenchmarkBridge(
+            smartkasa_conf={"phone_number": "bench", "password": "bench", "api_key": "bench"},
+            syrve_conf={"api_login": "bench"}
+        )
+
+        started = time.perf_counter()
+        if args.mode == "backfill":
+            bridge.backfill(args.start_date)
+        else:
+            bridge.sync_last_receipts()
+        elapsed = time.perf_counter() - started
+
+        from core.metrics import metrics
+        stats = servers.stats()
+        synced = Receipt.select().where(Receipt.step == "close_order").count()
+        http_calls = sum(sum(side["calls"].values()) for side in stats.values())
+        db.close()
+
+    return {
+        "mode": args.mode,
+        "receipts": args.receipts,
+        "synced": synced,
+        "elapsed_s": round(elapsed, 3),
+        "receipts_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "http_calls": http_calls,
+        "http_calls_per_receipt": round(http_calls / max(1, len(latencies)), 2),
+        "http_retries": bridge.smartkasa.http.retries + bridge.syrve.http.retries,
+        "sqlite_writes": writes.writes,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "endpoints": {name: side["calls"] for name, side in stats.items()},
+        "injected_errors": {name: side["errors"] for name, side in stats.items()},
+        "metrics": metrics.summary(),
+    }
+
+
+def print_report(result: Dict) -> None:
+    rows = [(key, value) for key, value in result.items() if not isinstance(value, dict) and key != "metrics"]
+    width = max(len(key) for key, _ in rows)
+    print()
+    for key, value in rows:
+        print(f"{key:<{width}}  {value}")
+    for name, calls in result["endpoints"].items():
+        print(f"\n{name} calls:")
+        for endpoint, count in sorted(calls.items()):
+            print(f"  {endpoint:<40} {count}")
+    print()
+    print(result["metrics"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SyncBridge end-to-end benchmark against local mock servers")
+    parser.add_argument("--mode", choices=("sync", "backfill"), default="sync", help="sync_last_receipts or backfill")
+    parser.add_argument("--receipts", type=int, default=1000, help="synthetic receipts served by SmartKasa")
+    parser.add_argument("--catalogue", type=int, default=5000, help="products in the SmartKasa inventory and Syrve nomenclature")
+    parser.add_argument("--unmapped-ratio", type=float, default=0.02, help="share of products missing from Syrve")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean server latency per request (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a 503 per request")
+    parser.add_argument("--command-delay", type=float, default=0.0, help="seconds a Syrve command stays InProgress")
+    parser.add_argument("--page-size", type=int, default=50, help="SmartKasa page size")
+    parser.add_argument("--workers", type=int, default=4, help="SYNC_WORKERS / SYRVE_ORDER_CONCURRENCY / BACKFILL_CONCURRENCY")
+    parser.add_argument("--start-date", default="2025-06-01T00:00:00", help="created_at of the first receipt")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON, e.g. to compare runs")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
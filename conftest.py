@@ -0,0 +1 @@
+# Lets `pytest` import the core/ and services/ packages from the repository root
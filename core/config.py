@@ -0,0 +1,23 @@
+import os
+from typing import Optional
+
+# The .env next to main.py, wherever the process is started from
+DEFAULT_ENV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env")
+
+_loaded = False
+
+
+def load_config(path: Optional[str] = None) -> None:
+    """
+    Fills os.environ from the .env file (DEFAULT_ENV_PATH unless `path` is given); variables already set in the
+    environment win. Modules read their settings with os.getenv at import time, so entry points call this once
+    before importing them. Later calls do nothing.
+    """
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    path = path or DEFAULT_ENV_PATH
+    if os.path.exists(path):
+        from dotenv import load_dotenv
+        load_dotenv(path)
@@ -0,0 +1,207 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from core.metrics import metrics
+from core.ratelimit import TokenBucket
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+# Retries after the first attempt; the delay grows as HTTP_BACKOFF_BASE * 2^attempt (full jitter), capped at HTTP_BACKOFF_MAX
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+# After this many consecutive failures an endpoint is short-circuited for CIRCUIT_RESET_TIMEOUT seconds
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """The endpoint failed too often recently; the request was not sent."""
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `reset_timeout` one trial request is let through (half-open)."""
+
+    def __init__(self, threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_request(self, name: str) -> bool:
+        """Raises CircuitOpenError while open. Returns True if this request is the half-open trial."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                raise CircuitOpenError(f"Circuit for {name} is open after {self._failures} consecutive failures")
+            self._trial_in_flight = True
+            return True
+
+    def release_trial(self) -> None:
+        """Ends a trial that proved nothing either way (e.g. a 401), so the next request becomes the trial."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpTransport:
+    """
+    Pooled requests.Session shared by the API services: timeouts, rate limiting, retries with exponential backoff
+    and jitter on 429/5xx and connection errors (honouring Retry-After), one token refresh on 401 and a circuit
+    breaker per endpoint.
+
+    Non-idempotent requests (idempotent=False) are retried only when the server cannot have processed them:
+    429 responses and failures to connect.
+    """
+
+    def __init__(self,
+                 name: str,
+                 pool_size: int = 10,
+                 rate_limiter: Optional[TokenBucket] = None,
+                 on_unauthorized: Optional[Callable[[requests.Response], None]] = None,
+                 max_retries: int = HTTP_MAX_RETRIES,
+                 timeout: tuple = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        self.name = name
+        self.rate_limiter = rate_limiter or TokenBucket(0)
+        self.on_unauthorized = on_unauthorized
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.retries = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._breakers_lock = threading.Lock()
+
+    def _breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._breakers_lock:
+            return self._breakers.setdefault(endpoint, CircuitBreaker())
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+    def request(self,
+                method: str,
+                url: str,
+                headers: Union[Dict[str, str], Callable[[], Dict[str, str]], None] = None,
+                endpoint: Optional[str] = None,
+                idempotent: bool = True,
+                refresh_on_401: bool = True,
+                **kwargs) -> requests.Response:
+        """
+        `headers` may be a callable, evaluated on every attempt so a refreshed token is picked up.
+        `endpoint` groups URLs under one circuit breaker (default: the URL path).
+        Returns the last response (the caller checks the status) or raises the last connection error / CircuitOpenError.
+        """
+        endpoint = endpoint or urlparse(url).path
+        breaker = self._breaker(endpoint)
+        refreshed = False
+        attempt = 0
+        labels = {"service": self.name, "endpoint": endpoint}
+        while True:
+            try:
+                trial = breaker.before_request(f"{self.name} {endpoint}")
+            except CircuitOpenError:
+                metrics.inc("http_circuit_open_total", **labels)
+                raise
+            try:
+                with metrics.span("http.rate_limit_wait", service=self.name):
+                    self.rate_limiter.acquire()
+                started = time.perf_counter()
+                try:
+                    response = self.session.request(
+                        method, url,
+                        headers=headers() if callable(headers) else headers,
+                        timeout=self.timeout,
+                        **kwargs
+                    )
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    metrics.observe("http_request_seconds", time.perf_counter() - started, status="error", **labels)
+                    breaker.record_failure()
+                    sent = not isinstance(e, requests.ConnectTimeout) and not _is_connect_error(e)
+                    if attempt >= self.max_retries or (sent and not idempotent):
+                        raise
+                    delay = self._backoff(attempt)
+                except requests.RequestException:
+                    # e.g. ChunkedEncodingError: the response broke off, not safe to retry blindly
+                    metrics.observe("http_request_seconds", time.perf_counter() - started, status="error", **labels)
+                    breaker.record_failure()
+                    raise
+                else:
+                    metrics.observe("http_request_seconds", time.perf_counter() - started, status=response.status_code, **labels)
+                    if response.status_code == 401 and refresh_on_401 and self.on_unauthorized and not refreshed:
+                        refreshed = True
+                        metrics.inc("http_token_refresh_total", service=self.name)
+                        self.on_unauthorized(response)
+                        continue
+
+                    if response.status_code not in RETRY_STATUSES:
+                        breaker.record_success()
+                        return response
+
+                    breaker.record_failure()
+                    if attempt >= self.max_retries or (response.status_code != 429 and not idempotent):
+                        return response
+                    retry_after = _retry_after(response)
+                    delay = retry_after if retry_after is not None else self._backoff(attempt)
+            finally:
+                # A trial that ended without an outcome (401 refresh, on_unauthorized or anything else raising)
+                # must not keep the circuit open for good
+                if trial:
+                    breaker.release_trial()
+
+            attempt += 1
+            self.retries += 1
+            metrics.inc("http_retries_total", **labels)
+            with metrics.span("http.backoff_sleep", service=self.name):
+                time.sleep(delay)
+
+
+def _is_connect_error(error: Exception) -> bool:
+    """True when the connection was never established, so the request cannot have reached the server."""
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)
+    return type(reason).__name__ in ("NewConnectionError", "NameResolutionError", "ConnectTimeoutError")
@@ -2,4 +2,13 @@ LOG_LEVEL_DEBUG = "DEBUG"
 LOG_LEVEL_INFO = "INFO"
 LOG_LEVEL_WARNING = "WARNING"
 LOG_LEVEL_ERROR = "ERROR"
-LOG_LEVEL_CRITICAL = "CRITICAL"
\ No newline at end of file
+LOG_LEVEL_CRITICAL = "CRITICAL"
+
+# Severity order used to compare levels against the configured thresholds
+LOG_LEVELS = {
+    LOG_LEVEL_DEBUG: 10,
+    LOG_LEVEL_INFO: 20,
+    LOG_LEVEL_WARNING: 30,
+    LOG_LEVEL_ERROR: 40,
+    LOG_LEVEL_CRITICAL: 50,
+}
@@ -0,0 +1,165 @@
+import os
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from core.metrics import metrics
+from core.nomenclature import Nomenclature
+
+# SmartKasa transaction_type_id of cash payments; everything else is treated as card
+CASH_TRANSACTION_TYPE_ID = 0
+
+
+def _unresolved(product_id) -> None:
+    return None
+
+
+@dataclass(frozen=True, slots=True)
+class PaymentMapping:
+    payment_type_id: Optional[str]
+    payment_type_kind: str
+
+    def payments(self, amount: float) -> List[dict]:
+        return [{
+            "paymentTypeId": self.payment_type_id,
+            "paymentTypeKind": self.payment_type_kind,
+            "sum": amount
+        }]
+
+
+@dataclass(frozen=True, slots=True)
+class DiscountMapping:
+    discount_type_id: Optional[str]
+    discount_type: Optional[str]
+
+    def discounts_info(self, amount: float) -> dict:
+        return {
+            "discounts": [{
+                "discountTypeId": self.discount_type_id,
+                "sum": amount,
+                "type": self.discount_type
+            }]
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class MappingConfig:
+    cash: PaymentMapping
+    card: PaymentMapping
+    discount: DiscountMapping
+
+    @classmethod
+    def from_env(cls) -> "MappingConfig":
+        # Cash receipts keep the "Card" payment kind the sync has always sent; only the payment type id differs
+        return cls(
+            cash=PaymentMapping(os.getenv("SURVE_TRANSACTION_TYPE_ID_CASH"), "Card"),
+            card=PaymentMapping(os.getenv("SURVE_TRANSACTION_TYPE_ID_CARD"), "Card"),
+            discount=DiscountMapping(os.getenv("SURVE_DISCOUT_TYPE_ID"), os.getenv("SURVE_DISCOUT_TYPE"))
+        )
+
+    def payment_for(self, transaction_type_id) -> PaymentMapping:
+        return self.cash if transaction_type_id == CASH_TRANSACTION_TYPE_ID else self.card
+
+
+class MappingPlan:
+    """
+    Everything needed to turn SmartKasa receipts into Syrve orders, resolved once per run: payment and discount
+    mapping and a SmartKasa product_id -> Syrve productId table. The table starts from the stored mappings that
+    still exist in the nomenclature; other products go through `resolve` once and the answer is kept. `resolve`
+    returns None only when a product has no counterpart; a lookup that failed must raise, so it is not memoized and
+    build_order raises for that receipt instead of dropping the item. Products without a counterpart are counted
+    for unmapped_report().
+    """
+
+    def __init__(self,
+                 config: MappingConfig,
+                 nomenclature: Nomenclature,
+                 product_mappings: Dict[str, str],
+                 resolve: Callable[[str], Optional[str]]):
+        self.config = config
+        self.resolve = resolve
+        self.products: Dict[str, Optional[str]] = {
+            sk_product_id: syrve_product_id
+            for sk_product_id, syrve_product_id in product_mappings.items()
+            if nomenclature.find_by_id(syrve_product_id)
+        }
+        self.unmapped = Counter()  # SmartKasa product_id -> receipt items that could not be mapped
+        self.unmatched_receipts = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Copies sent to other processes (see ReceiptReplay) carry the table but not the resolver or the counters:
+        # they only know the products resolved before pickling
+        return {"config": self.config, "products": self.products}
+
+    def __setstate__(self, state):
+        self.config = state["config"]
+        self.products = state["products"]
+        self.resolve = _unresolved
+        self.unmapped = Counter()
+        self.unmatched_receipts = 0
+        self._lock = threading.Lock()
+
+    def translate(self, product_id) -> Optional[str]:
+        product_id = str(product_id)
+        try:
+            return self.products[product_id]
+        except KeyError:
+            pass
+        # Memoized only once resolve has answered: an exception (lookup failed) leaves the product to be tried again
+        syrve_product_id = self.products[product_id] = self.resolve(product_id)
+        return syrve_product_id
+
+    @metrics.timed("mapping.build_order")
+    def build_order(self, receipt: dict) -> Optional[dict]:
+        """Maps a SmartKasa receipt to Syrve items, discounts and payments. Returns None if no product matched."""
+        items = []
+        missing = []
+        for item in receipt.get("items", ()):
+            syrve_product_id = self.translate(item.get("product_id"))
+            if syrve_product_id is None:
+                missing.append(str(item.get("product_id")))
+                continue
+            items.append({
+                "productId": syrve_product_id,
+                "type": "Product",
+                "amount": item.get("quantity", 1),
+                "price": item.get("price", 0.0)
+            })
+
+        if missing or not items:
+            with self._lock:
+                self.unmapped.update(missing)
+                if not items:
+                    self.unmatched_receipts += 1
+        if not items:
+            metrics.inc("receipts_unmapped_total")
+            return None
+
+        discount_amount = receipt.get("discount_amount")
+        discount = float(discount_amount) if discount_amount else 0.0
+
+        payment_tx = (receipt.get("payment_transactions") or [{}])[0]
+        payment = self.config.payment_for(payment_tx.get("transaction_type_id"))
+        amount = float(payment_tx.get("amount", 0))
+
+        return {
+            "receipt": receipt,
+            "items": items,
+            "discountsInfo": self.config.discount.discounts_info(discount) if discount > 0 else None,
+            "discount_amount": discount_amount,
+            "payments": payment.payments(amount),
+            "payment_type_id": payment.payment_type_id,
+            "payment_type_kind": payment.payment_type_kind,
+            "amount": amount
+        }
+
+    def unmapped_report(self, limit: int = 20) -> Optional[str]:
+        """One summary of the products that could not be mapped during the run, or None if all of them were."""
+        if not self.unmapped:
+            return None
+        top = ", ".join(f"{product_id} ×{count}" for product_id, count in self.unmapped.most_common(limit))
+        more = f" and {len(self.unmapped) - limit} more" if len(self.unmapped) > limit else ""
+        return (f"{len(self.unmapped)} SmartKasa products have no Syrve counterpart "
+                f"({sum(self.unmapped.values())} receipt items, {self.unmatched_receipts} receipts skipped entirely): {top}{more}")
@@ -0,0 +1,245 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Iterator, Optional, Tuple
+
+# Prometheus text exposition: a file rewritten after every run (e.g. for node_exporter's textfile collector)
+# and/or a local HTTP endpoint serving /metrics (0 disables it)
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Print a per-run table of counters and timings at the end of every sync / backfill
+METRICS_SUMMARY = os.getenv("METRICS_SUMMARY", "true").lower() == "true"
+
+PREFIX = "syncbridge_"
+# Upper bounds (seconds) of the span histogram buckets; +Inf is implicit
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, object]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], **extra) -> str:
+    pairs = list(labels) + [(k, str(v)) for k, v in extra.items()]
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        index = len(BUCKETS)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def copy(self) -> "Histogram":
+        other = Histogram()
+        other.counts = list(self.counts)
+        other.count, other.sum, other.min, other.max = self.count, self.sum, self.min, self.max
+        return other
+
+    def minus(self, earlier: Optional["Histogram"]) -> "Histogram":
+        if earlier is None:
+            return self.copy()
+        other = Histogram()
+        other.counts = [a - b for a, b in zip(self.counts, earlier.counts)]
+        # min/max stay the lifetime values: they only bound the quantile estimate
+        other.count, other.sum, other.min, other.max = self.count - earlier.count, self.sum - earlier.sum, self.min, self.max
+        return other
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimated from the buckets, interpolating linearly inside the bucket that holds the q-th observation,
+        and clamped to the observed min/max.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(max(estimate, self.min), self.max)
+            seen += count
+        return self.max
+
+
+class Metrics:
+    """
+    In-process counters and timing histograms with Prometheus text export. Thread-safe.
+    Spans are recorded in the syncbridge_span_seconds histogram, labelled with the span name.
+    """
+
+    def __init__(self):
+        self._counters: Dict[Key, float] = {}
+        self._histograms: Dict[Key, Histogram] = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("span_seconds", time.perf_counter() - started, span=name, **labels)
+
+    def timed(self, name: str):
+        """Decorator form of span()."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> dict:
+        """Point-in-time copy, to report what happened since (see summary)."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "histograms": {key: histogram.copy() for key, histogram in self._histograms.items()},
+            }
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, histogram.copy()) for key, histogram in self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), histogram in histograms:
+            metric = f"{PREFIX}{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{metric}_bucket{_format_labels(labels, le=le)} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """Atomically replaces `path`, so a collector never reads a half-written file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> None:
+        """Serves /metrics from a daemon thread."""
+        if self._server is not None:
+            return
+        # Imported here: http.server is slow to import and most commands never serve
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+
+    def summary(self, since: Optional[dict] = None) -> str:
+        """Table of counters and spans recorded after the `since` snapshot (everything if None)."""
+        current = self.snapshot()
+        before_counters = since["counters"] if since else {}
+        before_histograms = since["histograms"] if since else {}
+
+        lines = []
+        counters = [
+            (name + _format_labels(labels), value - before_counters.get((name, labels), 0))
+            for (name, labels), value in sorted(current["counters"].items())
+        ]
+        counters = [(name, value) for name, value in counters if value]
+        if counters:
+            width = max(len(name) for name, _ in counters)
+            lines.append(f"{'counter':<{width}}  {'value':>10}")
+            lines.extend(f"{name:<{width}}  {value:>10g}" for name, value in counters)
+
+        spans = []
+        for (name, labels), histogram in sorted(current["histograms"].items()):
+            delta = histogram.minus(before_histograms.get((name, labels)))
+            if delta.count:
+                if name == "span_seconds":
+                    values = dict(labels)
+                    span = values.pop("span", "")
+                    label = span + (f" ({','.join(values.values())})" if values else "")
+                else:
+                    label = name + _format_labels(labels)
+                spans.append((label, delta))
+        if spans:
+            width = max(len(label) for label, _ in spans)
+            lines.append("")
+            lines.append(f"{'span':<{width}}  {'count':>7}  {'total s':>9}  {'avg ms':>8}  {'p50 ms':>8}  {'p95 ms':>8}")
+            for label, delta in sorted(spans, key=lambda item: -item[1].sum):
+                lines.append(
+                    f"{label:<{width}}  {delta.count:>7}  {delta.sum:>9.2f}  {delta.sum / delta.count * 1000:>8.1f}"
+                    f"  {delta.quantile(0.5) * 1000:>8.1f}  {delta.quantile(0.95) * 1000:>8.1f}"
+                )
+        return "\n".join(lines)
+
+
+metrics = Metrics()
@@ -0,0 +1,39 @@
+from typing import Dict, List, Optional
+
+# Product fields that hold an article number / SKU in Syrve nomenclature
+SKU_FIELDS = ("num", "sku", "article")
+
+
+class Nomenclature:
+    """Syrve nomenclature response with hash indexes built once for O(1) product lookups."""
+
+    def __init__(self, data: dict):
+        self.revision = data.get("revision")
+        self.products: List[dict] = data.get("products", [])
+        self.by_code: Dict[str, dict] = {}
+        self.by_id: Dict[str, dict] = {}
+        self.by_sku: Dict[str, dict] = {}
+
+        # setdefault keeps the first product for duplicated keys, same as the old linear scan
+        for product in self.products:
+            if product.get("code"):
+                self.by_code.setdefault(product["code"], product)
+            if product.get("id"):
+                self.by_id.setdefault(product["id"], product)
+            for field in SKU_FIELDS:
+                if product.get(field):
+                    self.by_sku.setdefault(str(product[field]), product)
+            for barcode in product.get("barcodes") or []:
+                self.by_sku.setdefault(str(barcode), product)
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def find_by_code(self, code: str) -> Optional[dict]:
+        return self.by_code.get(code)
+
+    def find_by_id(self, product_id: str) -> Optional[dict]:
+        return self.by_id.get(product_id)
+
+    def find_by_sku(self, sku: str) -> Optional[dict]:
+        return self.by_sku.get(str(sku))
@@ -0,0 +1,60 @@
+import base64
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+
+# Access tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+
+
+def token_expires_at(token: str, default_ttl: float) -> float:
+    """Expiry of an access token as a time.time() timestamp: the JWT `exp` claim if present, otherwise now + default_ttl."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        if exp:
+            return float(exp)
+    except (IndexError, ValueError, AttributeError):
+        pass
+    return time.time() + default_ttl
+
+
+class AccessToken:
+    """
+    Bearer token of an API service, shared by tenants / workers. `authenticate` logs in and returns a new token;
+    only one caller at a time refreshes it, before it expires (ensure) or after a 401 (on_unauthorized).
+    """
+
+    def __init__(self, authenticate: Callable[[], str], default_ttl: float, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+        self.authenticate = authenticate
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.value: Optional[str] = None
+        self.expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        self.value = self.authenticate()
+        self.expires_at = token_expires_at(self.value, self.default_ttl)
+
+    def header(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.value}"} if self.value else {}
+
+    def ensure(self) -> bool:
+        """Authenticates only when there is no token or it expires within refresh_margin. Returns True if it did."""
+        with self._lock:
+            if self.value and time.time() < self.expires_at - self.refresh_margin:
+                return False
+            self._refresh()
+            return True
+
+    def on_unauthorized(self, response: requests.Response) -> None:
+        """HttpTransport hook: re-authenticates after a 401 unless another worker already replaced the rejected token."""
+        with self._lock:
+            if response.request.headers.get("Authorization") == self.header().get("Authorization"):
+                self._refresh()
@@ -1,26 +1,178 @@
+"""
+SmartKasa -> Syrve receipts sync.
+
+    python main.py [sync] [--full-backfill] [--tenants [PATH]]
+    python main.py daemon [--tenants [PATH]]
+    python main.py backfill DATE_FROM [--to DATE_TO]
+    python main.py resume [--tenants [PATH]]
+    python main.py replay [ARCHIVE] [--output PATH] [--organization ORG_ID]
+    python main.py stats [--json]
+    python main.py vacuum
+
+Configuration is loaded once, here; every command imports only the modules it needs, so stats and vacuum
+start without the HTTP clients and the sync services.
+"""
+import argparse
 import os
-from dotenv import load_dotenv
-from services.DBService import init_db
-from services.SyncBridge import SyncBridge
 
-load_dotenv()
+from core.config import load_config
+
+load_config()
 
 SMARTKASA_PHONE = os.getenv("SMARTKASA_PHONE")
 SMARTKASA_PASSWORD = os.getenv("SMARTKASA_PASSWORD")
 SMARTKASA_API_KEY = os.getenv("SMARTKASA_API_KEY")
 SYRVE_API_LOGIN = os.getenv("SYRVE_API_LOGIN")
+# vacuum: Log rows older than this are deleted; 0 vacuums every free page, otherwise at most this many per run
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
+COMPACT_VACUUM_PAGES = int(os.getenv("COMPACT_VACUUM_PAGES", "0"))
 
-if __name__ == "__main__":
-    init_db()
+
+def make_bridge(args):
+    """SyncBridge for the store configured in the environment, or a TenantScheduler with --tenants."""
+    from core.metrics import METRICS_PORT, metrics
+
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+
+    if args.tenants is not None:
+        from services.TenantScheduler import TenantScheduler, load_tenants
+        return TenantScheduler(load_tenants(args.tenants or None))
+
+    from services.SyncBridge import SyncBridge
     smartkasa_config = {
         "phone_number": SMARTKASA_PHONE,
         "password": SMARTKASA_PASSWORD,
         "api_key": SMARTKASA_API_KEY
     }
-
     syrve_config = {
         "api_login": SYRVE_API_LOGIN
     }
+    return SyncBridge(smartkasa_conf=smartkasa_config, syrve_conf=syrve_config)
+
+
+def sync(args):
+    make_bridge(args).sync_last_receipts(full_backfill=args.full_backfill)
+
+
+def daemon(args):
+    from services.SyncDaemon import SyncDaemon
+    SyncDaemon(make_bridge(args)).run()
+
+
+def backfill(args):
+    make_bridge(args).backfill(args.date_from, args.to)
+
+
+def resume(args):
+    from services.LoggerService import LoggerService
+    make_bridge(args).resume_unfinished_orders()
+    LoggerService.flush()
+
+
+def replay(args):
+    from services.LoggerService import LoggerService
+    from services.ReceiptArchive import RECEIPTS_ARCHIVE_PATH
+    from services.ReceiptReplay import ReceiptReplay
+    ReceiptReplay(args.archive or RECEIPTS_ARCHIVE_PATH, organization_id=args.organization).run(args.output)
+    LoggerService.flush()
+
+
+def stats(args):
+    """Read-only and without logging, for monitoring: no migrations run and nothing is written."""
+    import json
+    import sys
+    from peewee import OperationalError
+    from services.DBService import db, get_stats
 
-    bridge = SyncBridge(smartkasa_conf=smartkasa_config, syrve_conf=syrve_config)
-    bridge.sync_last_receipts()
+    # Connecting would create an empty file in place of a mistyped path
+    if not os.path.isfile(db.database):
+        sys.exit(f"stats: no database at {db.database}")
+    try:
+        result = get_stats()
+    except OperationalError as e:
+        sys.exit(f"stats: {db.database} has no sync tables ({e}), run a sync first")
+    if args.json:
+        print(json.dumps(result, default=str))
+        return
+    print(f"receipts           {result['receipts']}")
+    for step, count in sorted(result["receipts_by_step"].items()):
+        print(f"  {step:<16} {count}")
+    print(f"unfinished orders  {result['unfinished_orders']}")
+    for account, last_created_at in sorted(result["sync_cursors"].items()):
+        print(f"cursor {account}: {last_created_at}")
+    print(f"last log           {result['last_log_at']}")
+    print(f"errors (24h)       {result['errors_24h']}")
+    print(f"database size      {result['db_size_bytes'] / 1024 / 1024:.1f} MiB")
+
+
+def vacuum(args):
+    """Retention and compaction: prunes old logs and unreferenced payloads, then vacuums incrementally."""
+    from datetime import datetime, timedelta
+    from services.DBService import compact_db, prune_logs, prune_payloads
+    from services.LoggerService import LoggerService
+
+    logs = prune_logs(datetime.now() - timedelta(days=LOG_RETENTION_DAYS))
+    payloads = prune_payloads()
+    pages = compact_db(COMPACT_VACUUM_PAGES)
+    LoggerService.log(main_msg=f"[DB] 🧹 Deleted {logs} log rows older than {LOG_RETENTION_DAYS} days and {payloads} payloads, freed {pages} pages.")
+    LoggerService.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="SmartKasa -> Syrve receipts sync")
+    parser.add_argument("--db", metavar="PATH", help="SQLite database (default: SYNCBRIDGE_DB_PATH)")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    def tenants_option(command):
+        # --tenants without a PATH gives "": load_tenants then reads SYNC_TENANTS_FILE
+        command.add_argument("--tenants", nargs="?", const="", metavar="PATH", help="every store from the tenant registry (default: SYNC_TENANTS_FILE)")
+
+    command = commands.add_parser("sync", help="sync new receipts once (the default)")
+    command.add_argument("--full-backfill", action="store_true", help="ignore the sync cursor and fetch receipts from SYNC_START_DATE")
+    tenants_option(command)
+    command.set_defaults(handler=sync)
+
+    command = commands.add_parser("daemon", help="stay resident and poll for new receipts every SYNC_POLL_INTERVAL seconds")
+    tenants_option(command)
+    command.set_defaults(handler=daemon)
+
+    command = commands.add_parser("backfill", help="bulk-sync historical receipts")
+    command.add_argument("date_from", metavar="DATE_FROM", help="start of the range, inclusive (ISO date or datetime, UTC)")
+    command.add_argument("--to", metavar="DATE_TO", help="end of the range, inclusive: a date covers the whole day (ISO date or datetime, UTC; default: now)")
+    command.set_defaults(handler=backfill)
+
+    command = commands.add_parser("resume", help="finish orders left between create_order and close_order")
+    tenants_option(command)
+    command.set_defaults(handler=resume)
+
+    command = commands.add_parser("replay", help="dry run: map archived receipts and compare with the Receipt table, posting nothing")
+    command.add_argument("archive", nargs="?", metavar="ARCHIVE", help="receipts JSONL or .json dump (default: RECEIPTS_ARCHIVE_PATH)")
+    command.add_argument("--output", metavar="PATH", help="write the diff as JSON lines to this file")
+    command.add_argument("--organization", metavar="ORG_ID", help="Syrve organization whose nomenclature snapshot is used (needed if there are several)")
+    command.set_defaults(handler=replay)
+
+    command = commands.add_parser("stats", help="receipt counts, sync cursors and recent errors, read from the database only")
+    command.add_argument("--json", action="store_true", help="print one JSON object")
+    command.set_defaults(handler=stats, read_only=True)
+
+    command = commands.add_parser("vacuum", help="prune logs older than LOG_RETENTION_DAYS, drop unreferenced payloads and vacuum the database")
+    command.set_defaults(handler=vacuum)
+
+    parser.set_defaults(handler=sync, full_backfill=False, tenants=None, read_only=False)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    from services.DBService import init_db, open_db
+    if args.read_only:
+        open_db(args.db)
+    else:
+        init_db(args.db)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
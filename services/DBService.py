@@ -1,8 +1,54 @@
-from peewee import Model, SqliteDatabase, CharField, TextField, DateTimeField, AutoField
-from datetime import datetime
+from peewee import Model, SqliteDatabase, CharField, TextField, DateTimeField, AutoField, BigIntegerField, BlobField, SQL, Value, chunked, fn
+from datetime import datetime, timedelta
+from functools import wraps
+import json
+import os
+import threading
+import time
+import zlib
 
-DB_PATH = "syncbridge.db"
-db = SqliteDatabase(DB_PATH)
+from core.logger import LOG_LEVEL_CRITICAL, LOG_LEVEL_ERROR
+from core.metrics import metrics
+
+DB_PATH = os.getenv("SYNCBRIDGE_DB_PATH", "syncbridge.db")
+
+# WAL lets readers work while a writer commits; synchronous=NORMAL is durable with WAL and avoids an fsync per commit.
+# cache_size is negative = KiB
+SQLITE_PRAGMAS = {
+    # New databases free pages with PRAGMA incremental_vacuum (see compact_db) instead of a blocking full VACUUM.
+    # Must come first: switching to WAL writes the file header, after which auto_vacuum only changes with a VACUUM
+    "auto_vacuum": "incremental",
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "memory",
+}
+
+class InstrumentedSqliteDatabase(SqliteDatabase):
+    """Times every statement as a db.<verb> span (db.select, db.insert, ...)."""
+
+    def execute_sql(self, sql, params=None, commit=None):
+        verb = sql.split(None, 1)[0].lower() if sql.strip() else "query"
+        with metrics.span(f"db.{verb}"):
+            return super().execute_sql(sql, params, commit)
+
+
+# Deferred: open_db() sets the path, and peewee connects on the first query
+db = InstrumentedSqliteDatabase(None)
+
+# peewee gives every thread its own connection, but SQLite allows a single writer:
+# writes from sync workers are serialized here instead of failing with "database is locked"
+_write_lock = threading.RLock()
+
+def serialized_write(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        with _write_lock:
+            metrics.observe("span_seconds", time.perf_counter() - started, span="db.write_lock_wait")
+            return func(*args, **kwargs)
+    return wrapper
 
 class BaseModel(Model):
     class Meta:
@@ -11,14 +57,17 @@ class BaseModel(Model):
 class Receipt(BaseModel):
     id = CharField(primary_key=True)
     created_at = CharField()
-    step = CharField()
+    step = CharField(index=True)
     status = CharField()
     data = TextField()
     sk_created_at = CharField()
     sk_status = CharField()
-    sk_id = CharField()
+    sk_id = CharField(index=True)
     surve_id = CharField()
     payment_type = CharField(null=True)
+    payment_type_id = CharField(null=True)
+    organization_id = CharField(null=True)
+    account = CharField(null=True)  # SyncBridge.account of the store that created the order
     amount = CharField(null=True)
     discount = CharField(null=True)
     create_order_correlationId = CharField(null=True)
@@ -27,35 +76,321 @@ class Receipt(BaseModel):
 
 class Log(BaseModel):
     id = AutoField()
-    timestamp = DateTimeField(default=datetime.now)
+    timestamp = DateTimeField(default=datetime.now, index=True)
     level = CharField()
     message = TextField()
     receipt_id = CharField(null=True)
+    payload_id = CharField(null=True, index=True)  # Payload.key of the request/response this line is about
+
+    class Meta:
+        indexes = (
+            (("receipt_id", "timestamp"), False),
+        )
+
+class SyncCursor(BaseModel):
+    account = CharField(primary_key=True)
+    last_created_at = CharField()
+    updated_at = DateTimeField(default=datetime.now)
+
+class SmartKasaProduct(BaseModel):
+    product_id = CharField(primary_key=True)
+    data = TextField(null=True)  # JSON; null means SmartKasa answered 404 for this product
+    fetched_at = DateTimeField(default=datetime.now)
+
+class ProductMapping(BaseModel):
+    sk_product_id = CharField(primary_key=True)
+    alter_number = CharField(index=True)
+    syrve_product_id = CharField()
+    updated_at = DateTimeField(default=datetime.now)
 
-def init_db():
+class NomenclatureSnapshot(BaseModel):
+    organization_id = CharField(primary_key=True)
+    revision = BigIntegerField(null=True)
+    data = BlobField()  # zlib-compressed JSON of the nomenclature response
+    fetched_at = DateTimeField(default=datetime.now)
+    checked_at = DateTimeField(default=datetime.now)
+
+class Payload(BaseModel):
+    """Receipts and API payloads, stored once as zlib-compressed JSON and referenced by Receipt.data / Log.payload_id."""
+    key = CharField(primary_key=True)  # "<kind>:<ref_id>", see payload_key
+    data = BlobField()
+    created_at = DateTimeField(default=datetime.now)
+
+class Setting(BaseModel):
+    key = CharField(primary_key=True)
+    value = TextField()
+    updated_at = DateTimeField(default=datetime.now)
+
+MODELS = [Receipt, Log, SyncCursor, SmartKasaProduct, ProductMapping, NomenclatureSnapshot, Payload, Setting]
+
+def _add_indexes():
+    # Version 1 added the Receipt / Log indexes. init_db creates every index once the migrations have added the
+    # columns, then runs ANALYZE, so there is nothing left to do here
+    pass
+
+def _add_resume_columns():
+    from playhouse.migrate import SqliteMigrator, migrate
+    columns = {column.name for column in db.get_columns("receipt")}
+    migrator = SqliteMigrator(db)
+    for name in ("payment_type_id", "organization_id"):
+        if name not in columns:
+            migrate(migrator.add_column("receipt", name, getattr(Receipt, name)))
+
+def _add_log_payload_id():
+    from playhouse.migrate import SqliteMigrator, migrate
+    if "payload_id" not in {column.name for column in db.get_columns("log")}:
+        migrate(SqliteMigrator(db).add_column("log", "payload_id", Log.payload_id))
+
+def _add_receipt_account():
+    from playhouse.migrate import SqliteMigrator, migrate
+    if "account" not in {column.name for column in db.get_columns("receipt")}:
+        migrate(SqliteMigrator(db).add_column("receipt", "account", Receipt.account))
+
+# Applied in order to databases whose PRAGMA user_version is lower than the migration number
+MIGRATIONS = [
+    _add_indexes,
+    _add_resume_columns,
+    _add_log_payload_id,
+    _add_receipt_account,
+]
+
+def migrate_db():
+    """Applies the pending MIGRATIONS. Returns how many ran."""
+    version = db.pragma("user_version")
+    for number, migration in enumerate(MIGRATIONS, 1):
+        if number <= version:
+            continue
+        with db.atomic():
+            migration()
+        db.pragma("user_version", number)
+    return max(0, len(MIGRATIONS) - version)
+
+def open_db(path=None):
+    """Points the models at the database file (SYNCBRIDGE_DB_PATH by default) without creating or migrating anything."""
+    if db.deferred or path:
+        db.init(path or DB_PATH, pragmas=SQLITE_PRAGMAS)
+
+def init_db(path=None):
+    open_db(path)
     db.connect()
-    db.create_tables([Receipt, Log], safe=True)
+    # Indexes only after the migrations: an old database may not have the indexed columns yet
+    for model in MODELS:
+        model._schema.create_table(safe=True)
+    migrated = migrate_db()
+    for model in MODELS:
+        model._schema.create_indexes(safe=True)
+    if migrated:
+        db.execute_sql("ANALYZE")
     db.close()
 
+@serialized_write
 def add_receipt(**kwargs):
     Receipt.replace(**kwargs).execute()
 
-def add_log(level, message, receipt_id=None):
-    Log.create(
-        level=level,
-        message=message,
-        receipt_id=receipt_id
-    )
+@serialized_write
+def add_receipts(rows, payloads=()):
+    with db.atomic():
+        for batch in chunked(payloads, 100):
+            Payload.insert_many(batch).on_conflict_replace().execute()
+        for batch in chunked(rows, 50):
+            Receipt.insert_many(batch).on_conflict_replace().execute()
 
-def update_receipt_step(receipt_id, new_step):
-    query = Receipt.update(step=new_step).where(Receipt.id == receipt_id)
-    return query.execute()
-def update_add_payment_correlationId(receipt_id, correlation_id):
-    query = Receipt.update(add_payment_correlationId=correlation_id).where(Receipt.id == receipt_id)
-    return query.execute()
-def update_close_order_correlationId(receipt_id, correlation_id):
-    query = Receipt.update(close_order_correlationId=correlation_id).where(Receipt.id == receipt_id)
+@serialized_write
+def add_logs(rows, payloads=()):
+    """Stores Log rows and the Payload rows they reference in one transaction."""
+    with db.atomic():
+        for batch in chunked(payloads, 100):
+            Payload.insert_many(batch).on_conflict_replace().execute()
+        for batch in chunked(rows, 100):
+            Log.insert_many(batch).execute()
+
+@serialized_write
+def update_receipt_state(receipt_id, new_step, **fields):
+    """Moves a receipt to new_step and stores the transition's fields (e.g. correlationId) in one write."""
+    with db.atomic():
+        query = Receipt.update(step=new_step, **fields).where(Receipt.id == receipt_id)
+        return query.execute()
+
+# Steps after which an order exists in Syrve but is not closed yet. Orders recovery cannot finish on its own
+# (stored before the payment type / correlationIds were kept) are moved to step "manual" and left alone
+INTERMEDIATE_STEPS = ("create_order", "add_payment")
+
+def get_unfinished_receipts(organization_id, account, include_legacy=False, after_id=None, limit=100):
+    """
+    Receipts a store (account) created in an organization and left in an intermediate step, ordered by id;
+    pass the last id of a batch to get the next one. Stores sharing an organization never see each other's rows.
+    include_legacy also returns rows stored without account / organization_id.
+    """
+    owner_filter = (Receipt.organization_id == organization_id) & (Receipt.account == account)
+    if include_legacy:
+        owner_filter |= Receipt.account.is_null() & ((Receipt.organization_id == organization_id) | Receipt.organization_id.is_null())
+    query = Receipt.select().where(Receipt.step.in_(INTERMEDIATE_STEPS) & owner_filter)
+    if after_id is not None:
+        query = query.where(Receipt.id > after_id)
+    return list(query.order_by(Receipt.id).limit(limit))
+
+def count_unfinished_receipts():
+    return Receipt.select().where(Receipt.step.in_(INTERMEDIATE_STEPS)).count()
+
+@serialized_write
+def delete_receipt(receipt_id):
+    return Receipt.delete().where(Receipt.id == receipt_id).execute()
+
+def get_synced_sk_ids(sk_receipt_ids):
+    """Returns the subset of SmartKasa receipt ids that already have a Receipt row."""
+    synced = set()
+    for batch in chunked(list(sk_receipt_ids), 500):
+        query = Receipt.select(Receipt.sk_id).where(Receipt.sk_id.in_(batch)).tuples()
+        synced.update(sk_id for (sk_id,) in query)
+    return synced
+
+def get_receipts_by_sk_ids(sk_receipt_ids):
+    """SmartKasa receipt id -> Receipt row, for the ids that have one."""
+    receipts = {}
+    for batch in chunked(list(sk_receipt_ids), 500):
+        for receipt in Receipt.select().where(Receipt.sk_id.in_(batch)):
+            receipts[receipt.sk_id] = receipt
+    return receipts
+
+def get_sync_cursor(account):
+    cursor = SyncCursor.get_or_none(SyncCursor.account == account)
+    return cursor.last_created_at if cursor else None
+
+@serialized_write
+def update_sync_cursor(account, last_created_at):
+    SyncCursor.replace(account=account, last_created_at=last_created_at, updated_at=datetime.now()).execute()
+
+def get_cached_product(product_id):
+    return SmartKasaProduct.get_or_none(SmartKasaProduct.product_id == product_id)
+
+def get_cached_products():
+    """product_id -> product JSON of every cached product, without the ones SmartKasa answered 404 for."""
+    query = SmartKasaProduct.select(SmartKasaProduct.product_id, SmartKasaProduct.data).where(SmartKasaProduct.data.is_null(False))
+    return dict(query.tuples())
+
+@serialized_write
+def save_cached_products(rows):
+    with db.atomic():
+        for batch in chunked(rows, 100):
+            SmartKasaProduct.insert_many(batch).on_conflict_replace().execute()
+
+def get_product_mappings():
+    return {mapping.sk_product_id: mapping for mapping in ProductMapping.select()}
+
+@serialized_write
+def save_product_mapping(sk_product_id, alter_number, syrve_product_id):
+    ProductMapping.replace(
+        sk_product_id=sk_product_id,
+        alter_number=alter_number,
+        syrve_product_id=syrve_product_id,
+        updated_at=datetime.now()
+    ).execute()
+
+def get_nomenclature_snapshot(organization_id):
+    return NomenclatureSnapshot.get_or_none(NomenclatureSnapshot.organization_id == organization_id)
+
+def get_nomenclature_organization_ids():
+    return [organization_id for (organization_id,) in NomenclatureSnapshot.select(NomenclatureSnapshot.organization_id).tuples()]
+
+@serialized_write
+def save_nomenclature_snapshot(organization_id, revision, data):
+    now = datetime.now()
+    NomenclatureSnapshot.replace(
+        organization_id=organization_id,
+        revision=revision,
+        data=data,
+        fetched_at=now,
+        checked_at=now
+    ).execute()
+
+@serialized_write
+def touch_nomenclature_snapshot(organization_id):
+    query = NomenclatureSnapshot.update(checked_at=datetime.now()).where(NomenclatureSnapshot.organization_id == organization_id)
     return query.execute()
 
-def receipt_exists(sk_receipt_id):
-    return Receipt.select().where(Receipt.sk_id == sk_receipt_id).exists()
\ No newline at end of file
+def get_setting(key, max_age=None):
+    """Returns the stored value, or None when it is missing or older than max_age (timedelta)."""
+    setting = Setting.get_or_none(Setting.key == key)
+    if not setting or (max_age is not None and datetime.now() - setting.updated_at > max_age):
+        return None
+    return setting.value
+
+@serialized_write
+def set_setting(key, value):
+    Setting.replace(key=key, value=value, updated_at=datetime.now()).execute()
+def payload_key(kind, ref_id):
+    return f"{kind}:{ref_id}"
+
+def payload_row(key, data):
+    """Payload row for add_logs / add_receipts: compact JSON, zlib-compressed."""
+    return {
+        "key": key,
+        "data": zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")),
+        "created_at": datetime.now()
+    }
+
+def get_payloads(keys):
+    """Key -> stored JSON payload, for the keys that have one."""
+    payloads = {}
+    for batch in chunked(list(keys), 500):
+        for payload in Payload.select().where(Payload.key.in_(batch)):
+            payloads[payload.key] = json.loads(zlib.decompress(payload.data))
+    return payloads
+
+@serialized_write
+def prune_logs(before, batch_size=10000):
+    """Deletes Log rows older than `before` in batches, so the write lock is released in between. Returns the count."""
+    deleted = 0
+    while True:
+        with db.atomic():
+            ids = Log.select(Log.id).where(Log.timestamp < before).limit(batch_size)
+            count = Log.delete().where(Log.id.in_(ids)).execute()
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+@serialized_write
+def prune_payloads():
+    """
+    Deletes payloads that no Receipt or Log row references any more. Returns the count.
+    The syrve_order payload of an existing Receipt is kept too: ReceiptReplay compares against it.
+    """
+    referenced_by_logs = Log.select(Log.payload_id).where(Log.payload_id.is_null(False))
+    referenced_by_receipts = Receipt.select(Receipt.data)
+    sent_orders = Receipt.select(Value("syrve_order:").concat(Receipt.id))
+    return Payload.delete().where(
+        Payload.key.not_in(referenced_by_logs) & Payload.key.not_in(referenced_by_receipts) & Payload.key.not_in(sent_orders)
+    ).execute()
+
+def compact_db(max_pages=0):
+    """
+    Returns free pages to the filesystem: PRAGMA incremental_vacuum (all free pages if max_pages is 0).
+    Databases created before auto_vacuum=incremental are converted once with a full VACUUM.
+    Returns the number of pages freed.
+    """
+    with _write_lock:
+        before = db.pragma("page_count")
+        if db.pragma("auto_vacuum") != 2:
+            db.pragma("auto_vacuum", "incremental")
+            db.execute_sql("VACUUM")
+        else:
+            # sqlite3's execute() steps the pragma once, which frees a single page; executescript runs it to completion
+            db.connection().executescript(f"PRAGMA incremental_vacuum({int(max_pages)});" if max_pages else "PRAGMA incremental_vacuum;")
+        db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        # The conversion VACUUM can grow the file by the pointer-map pages incremental mode needs
+        return max(0, before - db.pragma("page_count"))
+
+def get_stats():
+    """Numbers for monitoring that SQLite answers from indexes: Receipt rows per step, sync cursors and recent logs."""
+    steps = dict(Receipt.select(Receipt.step, fn.COUNT(SQL("*"))).group_by(Receipt.step).tuples())
+    day_ago = datetime.now() - timedelta(days=1)
+    size = sum(os.path.getsize(path) for path in (db.database, f"{db.database}-wal") if os.path.exists(path))
+    return {
+        "receipts": sum(steps.values()),
+        "receipts_by_step": steps,
+        "unfinished_orders": sum(steps.get(step, 0) for step in INTERMEDIATE_STEPS),
+        "sync_cursors": dict(SyncCursor.select(SyncCursor.account, SyncCursor.last_created_at).tuples()),
+        "last_log_at": Log.select(fn.MAX(Log.timestamp)).scalar(),
+        "errors_24h": Log.select().where((Log.timestamp >= day_ago) & Log.level.in_((LOG_LEVEL_ERROR, LOG_LEVEL_CRITICAL))).count(),
+        "db_size_bytes": size,
+    }
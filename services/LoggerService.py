@@ -1,23 +1,139 @@
-from core.logger import LOG_LEVEL_INFO
-from services.DBService import add_log
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any
+
+from core.logger import LOG_LEVEL_DEBUG, LOG_LEVEL_INFO, LOG_LEVELS
+from services.DBService import add_logs, payload_row
+
+# Messages below these levels are not printed / not stored
+LOG_CONSOLE_LEVEL = os.getenv("LOG_CONSOLE_LEVEL", LOG_LEVEL_DEBUG)
+LOG_DB_LEVEL = os.getenv("LOG_DB_LEVEL", LOG_LEVEL_DEBUG)
+# Buffered Log rows are written in one transaction once there are this many, or this many seconds passed
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+
+
+class LogBuffer:
+    """Write-behind sink: a background thread stores queued Log and Payload rows with batched insert_many."""
+
+    _STOP = object()
+
+    def __init__(self, batch_size: int = LOG_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def put(self, row: dict, payload: dict = None) -> None:
+        """Queues a Log row (or None) and optionally a Payload row, written in the same transaction."""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+        self._queue.put((row, payload))
+
+    def _write(self, rows: list, payloads: list) -> None:
+        try:
+            add_logs(rows, payloads)
+        except Exception as e:
+            print(f"[LoggerService] Failed to store {len(rows)} log rows and {len(payloads)} payloads: {e}")
+
+    def _run(self) -> None:
+        batch, payloads = [], []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP or isinstance(item, threading.Event):
+                if batch or payloads:
+                    self._write(batch, payloads)
+                    batch, payloads = [], []
+                if item is self._STOP:
+                    return
+                item.set()
+            elif item is not None:
+                row, payload = item
+                if row is not None:
+                    batch.append(row)
+                if payload is not None:
+                    payloads.append(payload)
+
+            pending = len(batch) + len(payloads)
+            if pending >= self.batch_size or (pending and time.monotonic() >= deadline):
+                self._write(batch, payloads)
+                batch, payloads = [], []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+    def flush(self, timeout: float = None) -> None:
+        """Blocks until every row queued so far is stored."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+
 
 class LoggerService:
+    _buffer = LogBuffer()
+
     @staticmethod
     def log(
         main_msg: str,
         level: str = LOG_LEVEL_INFO,
         msg_log_db: str = "",
         msg_console: str = "",
-        receipt_id: str = None
+        receipt_id: str = None,
+        payload_id: str = None,
+        payload: Any = None
     ):
-        db_message = main_msg
-        if msg_log_db:
-            db_message += f" | {msg_log_db}"
+        """
+        `payload` (e.g. a receipt or an API response) is stored once, compressed, under `payload_id`
+        (see DBService.payload_key) and the Log row only references it. It is stored even when the
+        line itself is below LOG_DB_LEVEL. Pass just `payload_id` to reference a payload stored earlier.
+        """
+        severity = LOG_LEVELS.get(level, 0)
 
-        console_message = main_msg
-        if msg_console:
-            console_message += f" | {msg_console}"
+        row = None
+        if severity >= LOG_LEVELS.get(LOG_DB_LEVEL, 0):
+            db_message = main_msg
+            if msg_log_db:
+                db_message += f" | {msg_log_db}"
 
-        add_log(level, db_message, receipt_id)
+            row = {
+                "timestamp": datetime.now(),
+                "level": level,
+                "message": db_message,
+                "receipt_id": receipt_id,
+                "payload_id": payload_id
+            }
 
-        print(f"[{level}] {console_message}")
\ No newline at end of file
+        if row is not None or payload is not None:
+            LoggerService._buffer.put(row, payload_row(payload_id, payload) if payload is not None and payload_id else None)
+
+        if severity >= LOG_LEVELS.get(LOG_CONSOLE_LEVEL, 0):
+            console_message = main_msg
+            if msg_console:
+                console_message += f" | {msg_console}"
+
+            print(f"[{level}] {console_message}")
+
+    @staticmethod
+    def flush():
+        LoggerService._buffer.flush()
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+import time
+import zlib
+from typing import Dict, Tuple
+
+from core.nomenclature import Nomenclature
+from services.DBService import get_nomenclature_snapshot, save_nomenclature_snapshot, touch_nomenclature_snapshot
+from services.LoggerService import LoggerService
+from services.SyrveService import SyrveService
+
+# How long a snapshot is trusted before asking Syrve whether the revision changed
+NOMENCLATURE_REVISION_CHECK_INTERVAL = int(os.getenv("NOMENCLATURE_REVISION_CHECK_INTERVAL", "300"))
+
+
+class NomenclatureCache:
+    """
+    Syrve nomenclature per organization, kept in memory and as a compressed snapshot in SQLite.
+    The full catalogue is downloaded again only when the server revision is newer than the snapshot, or when the
+    server reports no revision to compare with.
+    """
+
+    def __init__(self, check_interval: int = NOMENCLATURE_REVISION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._entries: Dict[str, Tuple[Nomenclature, float]] = {}  # organization_id -> (nomenclature, checked_at)
+        # Tenants sharing an organization wait for one download instead of each fetching the catalogue
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _load_snapshot(self, organization_id: str):
+        snapshot = get_nomenclature_snapshot(organization_id)
+        if not snapshot:
+            return None
+        data = json.loads(zlib.decompress(snapshot.data))
+        return Nomenclature(data), snapshot.checked_at.timestamp()
+
+    def get(self, syrve: SyrveService, organization_id: str) -> Nomenclature:
+        with self._locks_guard:
+            lock = self._locks.setdefault(organization_id, threading.Lock())
+        with lock:
+            return self._get(syrve, organization_id)
+
+    def _get(self, syrve: SyrveService, organization_id: str) -> Nomenclature:
+        entry = self._entries.get(organization_id) or self._load_snapshot(organization_id)
+        if entry and time.time() - entry[1] < self.check_interval:
+            self._entries[organization_id] = entry
+            return entry[0]
+
+        cached = entry[0] if entry else None
+        data = syrve.get_nomenclature(organization_id, start_revision=cached.revision if cached else None)
+        revision = data.get("revision")
+
+        if cached and revision is not None and cached.revision is not None and revision <= cached.revision:
+            LoggerService.log(main_msg=f"[Syrve] Nomenclature revision {cached.revision} is up to date.")
+            touch_nomenclature_snapshot(organization_id)
+            self._entries[organization_id] = (cached, time.time())
+            return cached
+
+        if revision is None and cached and cached.revision is not None:
+            # Nothing to compare: the answer to startRevision may be partial, so take the whole catalogue
+            data = syrve.get_nomenclature(organization_id)
+            revision = data.get("revision")
+
+        nomenclature = Nomenclature(data)
+        blob = zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        save_nomenclature_snapshot(organization_id, revision, blob)
+        LoggerService.log(main_msg=f"[Syrve] Nomenclature revision {revision} downloaded: {len(nomenclature)} products, snapshot {len(blob) // 1024} KB.")
+        self._entries[organization_id] = (nomenclature, time.time())
+        return nomenclature
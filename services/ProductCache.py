@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from core.logger import LOG_LEVEL_WARNING
+from core.metrics import metrics
+from services.DBService import get_cached_product, save_cached_products
+from services.LoggerService import LoggerService
+from services.SmartKasaService import SmartKasaAPIError, SmartKasaService
+
+PRODUCT_CACHE_TTL = int(os.getenv("PRODUCT_CACHE_TTL", "86400"))
+PRODUCT_CACHE_NEGATIVE_TTL = int(os.getenv("PRODUCT_CACHE_NEGATIVE_TTL", "3600"))
+PRODUCT_CACHE_MAX_SIZE = int(os.getenv("PRODUCT_CACHE_MAX_SIZE", "10000"))
+PRODUCT_CACHE_WARM_UP = os.getenv("PRODUCT_CACHE_WARM_UP", "false").lower() == "true"
+
+
+class ProductCache:
+    """
+    SmartKasa products by product_id: an in-memory LRU for the run backed by the SmartKasaProduct table.
+    Unknown products (404) are cached as None for PRODUCT_CACHE_NEGATIVE_TTL seconds.
+    """
+
+    def __init__(self,
+                 smartkasa: SmartKasaService,
+                 ttl: int = PRODUCT_CACHE_TTL,
+                 negative_ttl: int = PRODUCT_CACHE_NEGATIVE_TTL,
+                 max_size: int = PRODUCT_CACHE_MAX_SIZE):
+        self.smartkasa = smartkasa
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # product_id -> (product or None, fetched_at)
+        self.hits = 0
+        self.misses = 0
+        # Guards the LRU and counters; HTTP and DB calls happen outside of it
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, product: Optional[Dict], fetched_at: float) -> bool:
+        ttl = self.ttl if product is not None else self.negative_ttl
+        return time.time() - fetched_at < ttl
+
+    def _put(self, product_id: str, product: Optional[Dict], fetched_at: float) -> None:
+        with self._lock:
+            self._entries[product_id] = (product, fetched_at)
+            self._entries.move_to_end(product_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, product_id: str, raise_on_error: bool = False) -> Optional[Dict]:
+        """None means SmartKasa does not know the product; a failed request returns None too unless raise_on_error is set."""
+        product_id = str(product_id)
+        with self._lock:
+            entry = self._entries.get(product_id)
+            if entry and self._is_fresh(*entry):
+                self._entries.move_to_end(product_id)
+                self.hits += 1
+                metrics.inc("product_cache_hits_total", source="memory")
+                return entry[0]
+
+        row = get_cached_product(product_id)
+        if row:
+            product = json.loads(row.data) if row.data is not None else None
+            fetched_at = row.fetched_at.timestamp()
+            if self._is_fresh(product, fetched_at):
+                self._put(product_id, product, fetched_at)
+                with self._lock:
+                    self.hits += 1
+                metrics.inc("product_cache_hits_total", source="db")
+                return product
+
+        with self._lock:
+            self.misses += 1
+        metrics.inc("product_cache_misses_total")
+        try:
+            product = self.smartkasa.get_product_by_id(product_id, raise_on_error=True)
+        except SmartKasaAPIError as e:
+            # Transient errors are not cached, the product is requested again next time
+            LoggerService.log(main_msg=f"[ProductCache] ⚠️ Failed to fetch product {product_id}: {e}", level=LOG_LEVEL_WARNING)
+            if raise_on_error:
+                raise
+            return None
+
+        now = datetime.now()
+        self._put(product_id, product, now.timestamp())
+        save_cached_products([{
+            "product_id": product_id,
+            "data": json.dumps(product, ensure_ascii=False) if product is not None else None,
+            "fetched_at": now
+        }])
+        return product
+
+    def warm_up(self) -> int:
+        """Loads the whole SmartKasa inventory in one paginated pass. Returns the number of cached products."""
+        now = datetime.now()
+        rows = []
+        for product in self.smartkasa.iter_products():
+            product_id = product.get("id")
+            if product_id is None:
+                continue
+            product_id = str(product_id)
+            self._put(product_id, product, now.timestamp())
+            rows.append({
+                "product_id": product_id,
+                "data": json.dumps(product, ensure_ascii=False),
+                "fetched_at": now
+            })
+        save_cached_products(rows)
+        return len(rows)
@@ -0,0 +1,35 @@
+import json
+import os
+from typing import Dict, Iterable, Iterator
+
+# Empty value disables the archive
+RECEIPTS_ARCHIVE_PATH = os.getenv("RECEIPTS_ARCHIVE_PATH", "")
+
+
+class ReceiptArchive:
+    """Append-only JSONL archive of raw SmartKasa receipts (one compact JSON document per line)."""
+
+    def __init__(self, path: str = RECEIPTS_ARCHIVE_PATH):
+        self.path = path
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def tee(self, receipts: Iterable[Dict]) -> Iterator[Dict]:
+        """Writes every receipt of the stream to the archive while passing it through unchanged."""
+        if not self.enabled:
+            yield from receipts
+            return
+
+        with open(self.path, "a", encoding="utf-8") as f:
+            for receipt in receipts:
+                f.write(json.dumps(receipt, ensure_ascii=False, separators=(",", ":")))
+                f.write("\n")
+                yield receipt
+
+    def read(self) -> Iterator[Dict]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
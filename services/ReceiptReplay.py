@@ -0,0 +1,223 @@
+import json
+import os
+import time
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from core.logger import LOG_LEVEL_WARNING
+from core.mapping import MappingConfig, MappingPlan
+from core.nomenclature import Nomenclature
+from services.DBService import get_cached_products, get_nomenclature_organization_ids, get_nomenclature_snapshot, get_payloads, get_product_mappings, get_receipts_by_sk_ids, payload_key
+from services.LoggerService import LoggerService
+from services.ReceiptArchive import RECEIPTS_ARCHIVE_PATH
+
+# Worker processes mapping receipts (0 = one per CPU) and archive lines sent to a worker at a time
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", "0"))
+REPLAY_CHUNK_SIZE = int(os.getenv("REPLAY_CHUNK_SIZE", "2000"))
+
+# Receipt columns compared against what the mapping would send now
+COMPARED_FIELDS = ("payment_type_id", "amount", "discount")
+# Order item fields compared against the items sent to Syrve (the syrve_order payload)
+COMPARED_ITEM_FIELDS = ("productId", "amount", "price")
+
+_worker_plan: Optional[MappingPlan] = None
+
+
+def _init_worker(plan: MappingPlan) -> None:
+    global _worker_plan
+    _worker_plan = plan
+
+
+def _replay_chunk(lines: List[str]) -> List[dict]:
+    """Runs in a worker process: parses archive lines and maps every receipt with the worker's copy of the plan."""
+    return [_replay_receipt(_worker_plan, json.loads(line)) for line in lines if line.strip()]
+
+
+def _replay_receipt(plan: MappingPlan, receipt: dict) -> dict:
+    """What the sync would store for the receipt, in the Receipt table's format (see SyncBridge._receipt_row), and the items it would send."""
+    result = {
+        "sk_id": receipt.get("id"),
+        "sk_created_at": receipt.get("created_at"),
+        "unmapped": [str(item.get("product_id")) for item in receipt.get("items", ()) if plan.translate(item.get("product_id")) is None],
+        "order": None,
+        "items": None
+    }
+    order = plan.build_order(receipt)
+    if order:
+        result["items"] = order["items"]
+        result["order"] = {
+            "items": len(order["items"]),
+            "payment_type_id": order["payment_type_id"],
+            "amount": str(order["amount"]),
+            "discount": str(order["discount_amount"])
+        }
+    return result
+
+
+class ReceiptReplay:
+    """
+    Dry run of the mapping over archived SmartKasa receipts (the ReceiptArchive JSONL, or a JSON dump of receipts):
+    nothing is requested from SmartKasa or Syrve and nothing is written. Products resolve through the stored mappings,
+    the SmartKasaProduct cache and the organization's nomenclature snapshot, so run a sync first to fill them.
+    Receipts are parsed and mapped in worker processes, then compared with the Receipt table:
+
+        create     no Receipt row yet, an order would be created
+        unmapped   no product matches, the receipt would be skipped
+        unchanged  a Receipt row exists and the payment type, amount, discount and items are the same
+        changed    a Receipt row exists but the mapping now gives a different payment type, amount, discount or items
+
+    Items (product, amount, price) are compared with what was sent to Syrve, stored as the syrve_order payload;
+    orders created before that payload was kept are compared on the Receipt columns only.
+    """
+
+    def __init__(self,
+                 path: str = RECEIPTS_ARCHIVE_PATH,
+                 organization_id: Optional[str] = None,
+                 workers: int = REPLAY_WORKERS,
+                 chunk_size: int = REPLAY_CHUNK_SIZE):
+        if not path:
+            raise ValueError("No archive to replay: pass a path or set RECEIPTS_ARCHIVE_PATH")
+        self.path = path
+        self.organization_id = organization_id
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    def _load_nomenclature(self) -> Nomenclature:
+        organization_id = self.organization_id
+        if not organization_id:
+            organization_ids = get_nomenclature_organization_ids()
+            if len(organization_ids) != 1:
+                raise ValueError(f"Pick the organization to replay for, nomenclature snapshots exist for {organization_ids or 'none'}")
+            organization_id = organization_ids[0]
+        snapshot = get_nomenclature_snapshot(organization_id)
+        if not snapshot:
+            raise ValueError(f"No nomenclature snapshot for organization {organization_id}, run a sync first")
+        return Nomenclature(json.loads(zlib.decompress(snapshot.data)))
+
+    def build_plan(self) -> MappingPlan:
+        """A plan resolved up front for every cached SmartKasa product, so workers never need a lookup of their own."""
+        nomenclature = self._load_nomenclature()
+        cached_products = get_cached_products()
+
+        def resolve(product_id: str) -> Optional[str]:
+            data = cached_products.get(product_id)
+            code = json.loads(data).get("alter_number") if data else None
+            syrve_product = nomenclature.find_by_code(code) if code else None
+            return syrve_product["id"] if syrve_product else None
+
+        stored = {sk_product_id: mapping.syrve_product_id for sk_product_id, mapping in get_product_mappings().items()}
+        plan = MappingPlan(MappingConfig.from_env(), nomenclature, stored, resolve)
+        for product_id in cached_products:
+            plan.translate(product_id)
+        return plan
+
+    def _chunks(self) -> Iterator[List[str]]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            if self.path.endswith(".json"):
+                data = json.load(f)
+                receipts = data.get("data", []) if isinstance(data, dict) else data
+                lines = (json.dumps(receipt, ensure_ascii=False) for receipt in receipts)
+            else:
+                lines = f
+            while chunk := list(islice(lines, self.chunk_size)):
+                yield chunk
+
+    def _map_receipts(self, plan: MappingPlan) -> Dict[str, dict]:
+        """SmartKasa receipt id -> replay result; for receipts archived more than once the last copy wins, like in the sync."""
+        results = {}
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(plan,)) as executor:
+            pending = deque()
+            for chunk in self._chunks():
+                pending.append(executor.submit(_replay_chunk, chunk))
+                if len(pending) >= self.workers * 2:
+                    results.update((result["sk_id"], result) for result in pending.popleft().result())
+            while pending:
+                results.update((result["sk_id"], result) for result in pending.popleft().result())
+        return results
+
+    @staticmethod
+    def _item_changes(sent: List[dict], mapped: List[dict]) -> Optional[list]:
+        """[items only sent, items only mapped now], compared as multisets of COMPARED_ITEM_FIELDS; None if they match."""
+        def key(item):
+            return tuple(item.get(field) for field in COMPARED_ITEM_FIELDS)
+
+        def as_dict(item_key):
+            return dict(zip(COMPARED_ITEM_FIELDS, item_key))
+
+        sent_keys = Counter(key(item) for item in sent)
+        mapped_keys = Counter(key(item) for item in mapped)
+        if sent_keys == mapped_keys:
+            return None
+        return [[as_dict(item_key) for item_key in (sent_keys - mapped_keys).elements()],
+                [as_dict(item_key) for item_key in (mapped_keys - sent_keys).elements()]]
+
+    @staticmethod
+    def _diff(result: dict, stored, sent_order: Optional[dict] = None) -> Tuple[str, dict]:
+        order = result["order"]
+        entry = {"sk_id": result["sk_id"], "sk_created_at": result["sk_created_at"]}
+        if stored is not None:
+            entry.update(surve_id=stored.surve_id, step=stored.step)
+        if result["unmapped"]:
+            entry["unmapped"] = result["unmapped"]
+        if order is None:
+            return "unmapped", entry
+
+        entry["order"] = order
+        if stored is None:
+            return "create", entry
+        changes = {
+            field: [getattr(stored, field), order[field]]
+            for field in COMPARED_FIELDS
+            if getattr(stored, field) != order[field]
+        }
+        if sent_order:
+            item_changes = ReceiptReplay._item_changes(sent_order["request"]["items"], result["items"])
+            if item_changes:
+                changes["items"] = item_changes
+        if changes:
+            entry["changes"] = changes
+            return "changed", entry
+        return "unchanged", entry
+
+    def run(self, output: Optional[str] = None) -> Counter:
+        """
+        Returns the number of receipts per status. With `output`, every receipt that is not unchanged is also written
+        there as one JSON line: {"status", "sk_id", "sk_created_at", "order", "changes", "unmapped", "surve_id", "step"}.
+        """
+        started = time.perf_counter()
+        plan = self.build_plan()
+        LoggerService.log(main_msg=f"[Replay] Replaying {self.path} with {len(plan.products)} known products on {self.workers} workers...")
+
+        results = self._map_receipts(plan)
+        stored = get_receipts_by_sk_ids(results)
+        sent_orders = get_payloads(payload_key("syrve_order", receipt.id) for receipt in stored.values())
+
+        statuses = Counter()
+        out = open(output, "w", encoding="utf-8") if output else None
+        try:
+            for sk_id, result in results.items():
+                receipt = stored.get(sk_id)
+                sent_order = sent_orders.get(payload_key("syrve_order", receipt.id)) if receipt is not None else None
+                status, entry = self._diff(result, receipt, sent_order)
+                statuses[status] += 1
+                plan.unmapped.update(result["unmapped"])
+                if status == "unmapped":
+                    plan.unmatched_receipts += 1
+                if out and status != "unchanged":
+                    out.write(json.dumps({"status": status, **entry}, ensure_ascii=False, default=str))
+                    out.write("\n")
+        finally:
+            if out:
+                out.close()
+
+        report = plan.unmapped_report()
+        if report:
+            LoggerService.log(main_msg=f"[Replay] ⚠️ {report}", level=LOG_LEVEL_WARNING)
+        elapsed = time.perf_counter() - started
+        LoggerService.log(main_msg=f"[Replay] ✅ {len(results)} receipts in {elapsed:.1f}s: "
+                                   + ", ".join(f"{statuses[status]} {status}" for status in ("create", "changed", "unchanged", "unmapped"))
+                                   + (f". Diff written to {output}." if output else "."))
+        return statuses
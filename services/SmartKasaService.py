@@ -1,35 +1,80 @@
 import os
-from dotenv import load_dotenv
 import requests
-from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, List
-
-load_dotenv()
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, Dict, Iterable, Iterator, List, Tuple
+
+from core.http import HttpTransport
+from core.logger import LOG_LEVEL_DEBUG
+from core.metrics import metrics
+from core.ratelimit import TokenBucket
+from core.tokens import AccessToken
+from services.LoggerService import LoggerService
+
+SMARTKASA_PAGE_CONCURRENCY = int(os.getenv("SMARTKASA_PAGE_CONCURRENCY", "4"))
+# Requests per second allowed towards SmartKasa (0 disables the limiter) and the burst size
+SMARTKASA_RATE_LIMIT = float(os.getenv("SMARTKASA_RATE_LIMIT", "0"))
+SMARTKASA_RATE_BURST = float(os.getenv("SMARTKASA_RATE_BURST", "0"))
+# Token lifetime assumed when the access token carries no exp claim (seconds)
+SMARTKASA_TOKEN_TTL = float(os.getenv("SMARTKASA_TOKEN_TTL", "3600"))
 
 class SmartKasaAPIError(Exception):
     """Custom exception for SmartKasa API errors."""
     pass
 
 
-class SmartKasaService:
-    BASE_URL = "https://core.smartkasa.ua"
+def parse_datetime(dt_str: str) -> datetime:
+    return datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
+
+
+def _is_date(value: str) -> bool:
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
 
-    def __init__(self, phone_number: str, password: str, api_key: str):
+class SmartKasaService:
+    BASE_URL = os.getenv("SMARTKASA_BASE_URL", "https://core.smartkasa.ua")
+
+    def __init__(self,
+                 phone_number: str,
+                 password: str,
+                 api_key: str,
+                 page_concurrency: int = SMARTKASA_PAGE_CONCURRENCY,
+                 rate_limiter: Optional[TokenBucket] = None):
         self.phone_number = phone_number
         self.password = password
         self.api_key = api_key
-        self.access_token: Optional[str] = None
+        self.token = AccessToken(self.authenticate, SMARTKASA_TOKEN_TTL)
+        self.page_concurrency = max(1, page_concurrency)
+
+        # One pooled session keeps TCP/TLS connections alive between requests and page workers; the transport
+        # also retries 429/5xx/connection errors and refreshes the token on 401
+        self.http = HttpTransport(
+            "SmartKasa",
+            pool_size=self.page_concurrency,
+            rate_limiter=rate_limiter or TokenBucket(SMARTKASA_RATE_LIMIT, SMARTKASA_RATE_BURST or None),
+            on_unauthorized=self.token.on_unauthorized
+        )
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        return self.http.request(method, url, **kwargs)
 
     def _get_headers(self, include_auth: bool = True) -> Dict[str, str]:
         headers = {
             'Content-Type': 'application/json',
             'X-Api-Key': self.api_key
         }
-        if include_auth and self.access_token:
-            headers['Authorization'] = f"Bearer {self.access_token}"
+        if include_auth:
+            headers.update(self.token.header())
         return headers
 
-    def authenticate(self) -> None:
+    @metrics.timed("smartkasa.authenticate")
+    def authenticate(self) -> str:
+        """Logs in and returns a new access token; self.token calls it when the current one expires or is rejected."""
         url = f"{self.BASE_URL}/api/v1/auth/sessions"
         payload = {
             "session": {
@@ -37,11 +82,14 @@ class SmartKasaService:
                 "password": self.password
             }
         }
-        response = requests.post(url, headers=self._get_headers(include_auth=False), json=payload)
+        response = self._request('POST', url, headers=self._get_headers(include_auth=False), json=payload, refresh_on_401=False)
         if response.status_code == 201:
-            self.access_token = response.json()['data']['access']
-        else:
-            raise SmartKasaAPIError(f"Auth failed: {response.status_code}, {response.text}")
+            return response.json()['data']['access']
+        raise SmartKasaAPIError(f"Auth failed: {response.status_code}, {response.text}")
+
+    def ensure_authenticated(self) -> bool:
+        """Authenticates only when there is no token or it expires within TOKEN_REFRESH_MARGIN. Returns True if it did."""
+        return self.token.ensure()
 
     def get_invoices(self, date_start: str = None, date_end: str=None) -> List[Dict]:
         url = f"{self.BASE_URL}/api/v1/pos/receipts"
@@ -49,68 +97,93 @@ class SmartKasaService:
             'date_start': date_start,
             'date_end': date_end
         }
-        response = requests.get(url, headers=self._get_headers(), params=params)
+        response = self._request('GET', url, headers=self._get_headers, params=params)
 
         if response.status_code == 200:
             return response.json().get('data', [])
         else:
             raise SmartKasaAPIError(f"Get invoices failed: {response.status_code}, {response.text}")
 
-    def get_invoices_all_pages(self, date_start: str = None, date_end: str = None) -> List[Dict]:
-        url = f"{self.BASE_URL}/api/v1/pos/receipts"
-        all_data = []
-        page = 1
-
-        while True:
-            print(f"Fetching page {page}...")
-            params = {
-                'date_start': date_start,
-                'date_end': date_end,
-                'page': page
-            }
-            response = requests.get(url, headers=self._get_headers(), params=params)
-            if response.status_code != 200:
-                raise SmartKasaAPIError(f"Get invoices failed: {response.status_code}, {response.text}")
-
-            data = response.json().get('data', [])
-            all_data.extend(data)
-            meta = response.json().get('meta', {})
+    @metrics.timed("smartkasa.get_page")
+    def _get_page(self, url: str, params: Dict, page: int) -> Tuple[List[Dict], Dict]:
+        LoggerService.log(main_msg=f"[SmartKasa] Fetching page {page} of {url}...", level=LOG_LEVEL_DEBUG)
+        response = self._request('GET', url, headers=self._get_headers, params={**params, 'page': page})
+        if response.status_code != 200:
+            raise SmartKasaAPIError(f"Get page {page} of {url} failed: {response.status_code}, {response.text}")
+
+        body = response.json()
+        return body.get('data', []), body.get('meta', {})
+
+    def _iter_pages(self, url: str, params: Dict) -> Iterator[Dict]:
+        data, meta = self._get_page(url, params, 1)
+        yield from data
+
+        total_pages = meta.get('total_pages')
+        if total_pages and self.page_concurrency > 1:
+            # Page count is known up front: keep up to page_concurrency pages in flight and yield them in order,
+            # so at most that many pages are held in memory at once
+            with ThreadPoolExecutor(max_workers=self.page_concurrency) as executor:
+                pending = deque()
+                next_page = 2
+                while pending or next_page <= total_pages:
+                    while next_page <= total_pages and len(pending) < self.page_concurrency:
+                        pending.append(executor.submit(self._get_page, url, params, next_page))
+                        next_page += 1
+                    page_data, _ = pending.popleft().result()
+                    yield from page_data
+            return
+
+        next_page = meta.get('next_page')
+        while next_page:
+            data, meta = self._get_page(url, params, next_page)
+            yield from data
             next_page = meta.get('next_page')
-            if not next_page:
-                break
-            page = next_page
 
-        return all_data
+    def get_invoices_all_pages(self, date_start: str = None, date_end: str = None) -> Iterator[Dict]:
+        """Yields receipts page by page instead of loading the whole history into memory."""
+        url = f"{self.BASE_URL}/api/v1/pos/receipts"
+        params = {
+            'date_start': date_start,
+            'date_end': date_end
+        }
+        return self._iter_pages(url, params)
 
-    def get_product_by_id(self, product_id: str) -> Optional[Dict]:
+    @metrics.timed("smartkasa.get_product")
+    def get_product_by_id(self, product_id: str, raise_on_error: bool = False) -> Optional[Dict]:
+        """Returns None for unknown products (404). Other errors return None too unless raise_on_error is set."""
         url = f"{self.BASE_URL}/api/v1/inventory/products/{product_id}"
-        response = requests.get(url, headers=self._get_headers())
+        response = self._request('GET', url, headers=self._get_headers, endpoint="/api/v1/inventory/products/{id}")
         if response.status_code == 200:
             return response.json().get('data')
+        elif response.status_code != 404 and raise_on_error:
+            raise SmartKasaAPIError(f"Get product {product_id} failed: {response.status_code}, {response.text}")
         else:
             print(f"[get_product_by_id] Error: {response.status_code}, {response.text}")
             return None
 
-    def filter_receipts_by_date(self, receipts: list, date_from: str = None, date_to: str = None) -> list:
-        def parse_date(dt_str):
-            return datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-
-        filtered = []
+    def iter_products(self) -> Iterator[Dict]:
+        """Yields the whole SmartKasa inventory page by page."""
+        url = f"{self.BASE_URL}/api/v1/inventory/products"
+        return self._iter_pages(url, {})
+
+    def filter_receipts_by_date(self, receipts: Iterable[Dict], date_from: str = None, date_to: str = None) -> Iterator[Dict]:
+        """Both bounds are inclusive (UTC); a date_to without a time covers that whole day."""
+        from_dt = datetime.fromisoformat(date_from).replace(tzinfo=timezone.utc) if date_from else None
+        to_dt = datetime.fromisoformat(date_to).replace(tzinfo=timezone.utc) if date_to else None
+        if to_dt and _is_date(date_to):
+            to_dt += timedelta(days=1) - timedelta(microseconds=1)
         for receipt in receipts:
-            created = parse_date(receipt["created_at"])
-            if date_from:
-                from_dt = datetime.fromisoformat(date_from).replace(tzinfo=timezone.utc)
-                if created < from_dt:
-                    continue
-            if date_to:
-                to_dt = datetime.fromisoformat(date_to).replace(tzinfo=timezone.utc)
-                if created > to_dt:
-                    continue
-            filtered.append(receipt)
-        return filtered
+            created = parse_datetime(receipt["created_at"])
+            if from_dt and created < from_dt:
+                continue
+            if to_dt and created > to_dt:
+                continue
+            yield receipt
 
 if __name__ == "__main__":
-    
+    from core.config import load_config
+    load_config()
+
     SMARTKASA_PHONE = os.getenv("SMARTKASA_PHONE")
     SMARTKASA_PASSWORD = os.getenv("SMARTKASA_PASSWORD")
     SMARTKASA_API_KEY = os.getenv("SMARTKASA_API_KEY")
@@ -122,7 +195,7 @@ if __name__ == "__main__":
     )
 
     try:
-        smartkasa.authenticate()
+        smartkasa.ensure_authenticated()
 
         yesterday = datetime.now() - timedelta(days=100)
         date_str = yesterday.strftime('%Y-%m-%d')
@@ -137,7 +210,7 @@ if __name__ == "__main__":
             print(receipts[0])
             for r in receipts: 
                 print(f"- ID: {r.get('id')}, Сума: {r.get('total_amount')} грн, Дата: {r.get('created_at')}")
-                print(f"- payment_transactions: {r.get('payment_transactions')[0].get("transaction_type_id")}")
+                print(f"- payment_transactions: {r.get('payment_transactions')[0].get('transaction_type_id')}")
 
     except SmartKasaAPIError as e:
         print(f"Помилка API: {e}")
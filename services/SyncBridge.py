@@ -1,175 +1,588 @@
-import json
+import hashlib
 import os
+import threading
 import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+from typing import Iterable, Iterator, Optional, Tuple
 
-from dotenv import load_dotenv
+from peewee import chunked
 
 from core.logger import LOG_LEVEL_ERROR, LOG_LEVEL_WARNING
-from services.DBService import add_receipt, receipt_exists, update_add_payment_correlationId, update_close_order_correlationId, update_receipt_step
+from core.mapping import MappingConfig, MappingPlan
+from core.metrics import METRICS_SUMMARY, METRICS_TEXTFILE, metrics
+from core.nomenclature import Nomenclature
+from services.DBService import ProductMapping, Receipt, add_receipt, add_receipts, count_unfinished_receipts, delete_receipt, get_unfinished_receipts, get_product_mappings, get_setting, get_sync_cursor, get_synced_sk_ids, payload_key, payload_row, save_product_mapping, set_setting, update_receipt_state, update_sync_cursor
 from services.LoggerService import LoggerService
-from services.SmartKasaService import SmartKasaService
-from services.SyrveService import SyrveService
+from services.NomenclatureCache import NomenclatureCache
+from services.ProductCache import PRODUCT_CACHE_WARM_UP, ProductCache
+from services.ReceiptArchive import ReceiptArchive
+from services.SmartKasaService import SmartKasaService, parse_datetime
+from services.SyrveService import SyrveCommandError, SyrveService
+
+# Start of history used when there is no sync cursor yet or on an explicit full backfill
+SYNC_START_DATE = os.getenv("SYNC_START_DATE", "2025-06-01")
+# Organization / terminal group ids rarely change, so they are reused between runs for this long (seconds)
+SYRVE_IDS_CACHE_TTL = int(os.getenv("SYRVE_IDS_CACHE_TTL", "86400"))
+# Fetched receipts are checked against the Receipt table in batches of this size
+DEDUP_BATCH_SIZE = int(os.getenv("DEDUP_BATCH_SIZE", "500"))
+# Receipts processed at the same time (1 processes them strictly one by one)
+SYNC_WORKERS = max(1, int(os.getenv("SYNC_WORKERS", "4")))
+# Orders that may be in flight in Syrve at the same time
+SYRVE_ORDER_CONCURRENCY = max(1, int(os.getenv("SYRVE_ORDER_CONCURRENCY", "4")))
+# Recovery pass for orders stuck between create_order and close_order
+RESUME_ON_START = os.getenv("RESUME_ON_START", "true").lower() == "true"
+RESUME_BATCH_SIZE = int(os.getenv("RESUME_BATCH_SIZE", "100"))
+# Backfill: orders submitted at the same time and receipts per Receipt-table write
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "16"))
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "200"))
+# Receipts that reach SmartKasa late are picked up by re-reading this window before the cursor
+SYNC_OVERLAP_MINUTES = int(os.getenv("SYNC_OVERLAP_MINUTES", "10"))
+
+def report_metrics(since: dict, title: str) -> None:
+    """Rewrites METRICS_TEXTFILE and logs the table of everything recorded since the `since` snapshot."""
+    if METRICS_TEXTFILE:
+        try:
+            metrics.write_textfile(METRICS_TEXTFILE)
+        except OSError as e:
+            LoggerService.log(main_msg=f"[Metrics] ⚠️ Failed to write {METRICS_TEXTFILE}: {e}", level=LOG_LEVEL_WARNING)
+    if METRICS_SUMMARY:
+        LoggerService.log(main_msg=f"[Metrics] 📊 {title}\n{metrics.summary(since)}")
 
-load_dotenv()
 
 class SyncBridge:
-    def __init__(self, smartkasa_conf: dict, syrve_conf: dict):
-        self.smartkasa = SmartKasaService(**smartkasa_conf)
-        self.syrve = SyrveService(api_login=syrve_conf["api_login"])
+    def __init__(self,
+                 smartkasa_conf: dict,
+                 syrve_conf: dict,
+                 name: Optional[str] = None,
+                 smartkasa: Optional[SmartKasaService] = None,
+                 syrve: Optional[SyrveService] = None,
+                 products: Optional[ProductCache] = None,
+                 nomenclature_cache: Optional[NomenclatureCache] = None):
+        """
+        smartkasa_conf / syrve_conf configure a single store. Syrve may pin organization_id / terminal_group_id
+        instead of using the first ones of the account. The optional services and caches let several tenants
+        share logins, tokens, rate limits and nomenclature (see TenantScheduler).
+        """
+        self.name = name
+        self.smartkasa = smartkasa or SmartKasaService(**smartkasa_conf)
+        self.syrve = syrve or SyrveService(api_login=syrve_conf["api_login"])
+        self.organization_id = syrve_conf.get("organization_id")
+        self.terminal_group_id = syrve_conf.get("terminal_group_id")
+        self.account = name or self.smartkasa.phone_number
+        self.archive = ReceiptArchive()
+        self.products = products or ProductCache(self.smartkasa)
+        self.product_mappings = {}
+        self.nomenclature_cache = nomenclature_cache or NomenclatureCache()
+        self._order_slots = threading.BoundedSemaphore(SYRVE_ORDER_CONCURRENCY)
+        self._syrve_context = None
+        self._warmed_up = False
+        # TenantScheduler reports once per cycle instead of once per tenant
+        self.report_metrics = True
+
+    def _connect_syrve(self):
+        """Makes sure the Syrve token is valid and returns (org_id, term_id), resolved once per run."""
+        if self.syrve.ensure_authenticated():
+            LoggerService.log(main_msg=f"[Syrve] ✅ Authorization successful.")
+        if self._syrve_context is None:
+            self._syrve_context = self._get_syrve_ids()
+        return self._syrve_context
+
+    def _get_syrve_ids(self):
+        """Organization and terminal group ids, cached in the Setting table for SYRVE_IDS_CACHE_TTL."""
+        max_age = timedelta(seconds=SYRVE_IDS_CACHE_TTL)
+        login_hash = hashlib.sha256(self.syrve.api_login.encode("utf-8")).hexdigest()[:16]
+
+        org_key = f"syrve_organization_id:{login_hash}"
+        org_id = self.organization_id or get_setting(org_key, max_age)
+        if not org_id:
+            org_id = self.syrve.get_organization_id()
+            set_setting(org_key, org_id)
+
+        term_key = f"syrve_terminal_group_id:{org_id}"
+        term_id = self.terminal_group_id or get_setting(term_key, max_age)
+        if not term_id:
+            term_id = self.syrve.get_terminal_group_id(org_id)
+            set_setting(term_key, term_id)
+
+        return org_id, term_id
+
+    def _resolve_syrve_product_id(self, product_id, nomenclature: Nomenclature) -> Optional[str]:
+        """
+        SmartKasa product_id -> Syrve productId, using the stored mapping before SmartKasa/nomenclature lookups.
+        None means there is no counterpart; a failed SmartKasa lookup raises, so MappingPlan does not memoize it.
+        """
+        product_id = str(product_id)
+        mapping = self.product_mappings.get(product_id)
+        if mapping and nomenclature.find_by_id(mapping.syrve_product_id):
+            return mapping.syrve_product_id
+
+        smartkasa_product = self.products.get(product_id, raise_on_error=True)
+        if not smartkasa_product:
+            LoggerService.log(main_msg=f"[SmartKasa][!] ❌ SmartKasa product not found: {product_id}", level=LOG_LEVEL_WARNING)
+            return None
+
+        product_code = smartkasa_product.get("alter_number")
+        LoggerService.log(main_msg=f"[SmartKasa] ➡️ Product: {smartkasa_product.get('alter_title')} (Code: {product_code})")
+
+        syrve_product = self.syrve.find_product_by_code(nomenclature, product_code)
+        if not syrve_product:
+            LoggerService.log(main_msg=f"[Syrve][!] ❌ Product with code {product_code} not found in Syrve.", level=LOG_LEVEL_WARNING)
+            return None
+
+        save_product_mapping(product_id, product_code, syrve_product["id"])
+        self.product_mappings[product_id] = ProductMapping(sk_product_id=product_id, alter_number=product_code, syrve_product_id=syrve_product["id"])
+        return syrve_product["id"]
+
+    def _get_sync_window(self, full_backfill: bool = False):
+        """Returns (date_start for the SmartKasa API, precise UTC date_from for local filtering)."""
+        cursor = None if full_backfill else get_sync_cursor(self.account)
+        if cursor:
+            start = parse_datetime(cursor) - timedelta(minutes=SYNC_OVERLAP_MINUTES)
+        else:
+            start = datetime.fromisoformat(SYNC_START_DATE).replace(tzinfo=timezone.utc)
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+        return start.strftime("%Y-%m-%d"), start.isoformat()
+
+    def _mapping_plan(self, nomenclature: Nomenclature) -> MappingPlan:
+        """Payment/discount config and the product translation table, resolved once per run."""
+        if not self.product_mappings:
+            self.product_mappings = get_product_mappings()
+        return MappingPlan(
+            MappingConfig.from_env(),
+            nomenclature,
+            {sk_product_id: mapping.syrve_product_id for sk_product_id, mapping in self.product_mappings.items()},
+            lambda product_id: self._resolve_syrve_product_id(product_id, nomenclature)
+        )
 
-    def sync_last_receipts(self):
+    @staticmethod
+    def _report_unmapped(plan: MappingPlan) -> None:
+        report = plan.unmapped_report()
+        if report:
+            LoggerService.log(main_msg=f"[Mapping] ⚠️ {report}", level=LOG_LEVEL_WARNING)
+
+    @staticmethod
+    def _order_payload(order: dict, result: dict) -> dict:
+        """What was sent to Syrve for a receipt and what order/create answered, stored as the syrve_order payload."""
+        return {
+            "request": {"items": order["items"], "discountsInfo": order["discountsInfo"], "payments": order["payments"]},
+            "response": result
+        }
+
+    def _receipt_row(self, order: dict, result: dict, org_id: str, step: str = "create_order") -> dict:
+        receipt = order["receipt"]
+        order_info = result.get("orderInfo") or {}
+        return {
+            "id": order_info.get("id"),
+            "created_at": order_info.get("timestamp"),
+            "step": step,
+            "status": order_info.get("creationStatus"),
+            # The SmartKasa receipt itself lives in the Payload table
+            "data": payload_key("sk_receipt", receipt.get("id")),
+            "sk_created_at": receipt.get("created_at"),
+            "sk_status": receipt.get("state"),
+            "sk_id": receipt.get("id"),
+            "surve_id": order_info.get("id"),
+            "payment_type": order["payment_type_kind"],
+            "payment_type_id": order["payment_type_id"],
+            "organization_id": org_id,
+            "account": self.account,
+            "amount": str(order["amount"]),
+            "discount": str(order["discount_amount"]),
+            "create_order_correlationId": result.get("correlationId"),
+            "add_payment_correlationId": None,
+            "close_order_correlationId": None
+        }
+
+    @metrics.timed("backfill.submit_order")
+    def _submit_order_inline(self, order: dict, org_id: str, term_id: str) -> Tuple[Optional[dict], Optional[Exception]]:
+        """
+        Backfill variant of _submit_order: the payment goes inline with create_order, then the order is closed.
+        Like in _submit_order, the Receipt row is stored as soon as Syrve accepts create_order. Returns the row's later
+        progress for the batched write (None if there is nothing more to store) and the error, if any.
+        """
         try:
-            LoggerService.log(main_msg="[SmartKasa] Authorization...")
+            result = self.syrve.create_order(org_id, term_id, order["items"], discountsInfo=order["discountsInfo"], payments=order["payments"])
+        except Exception as e:
+            return None, e
 
-            self.smartkasa.authenticate()
-            LoggerService.log(main_msg="[SmartKasa] ✅ Authorization successful.")
+        row = self._receipt_row(order, result, org_id)
+        # The payment is part of the create command: the same correlationId confirms both, and recovery must never add it again
+        row["add_payment_correlationId"] = row["create_order_correlationId"]
+        add_receipts([row], [
+            payload_row(row["data"], order["receipt"]),
+            payload_row(payload_key("syrve_order", row["id"]), self._order_payload(order, result))
+        ])
+        try:
+            self.syrve.wait_for_command(org_id, row["create_order_correlationId"])
+        except SyrveCommandError as e:
+            # The order was never created in Syrve: release the receipt so a later run creates it again
+            delete_receipt(row["id"])
+            return None, e
+        except Exception as e:
+            # Still unconfirmed (e.g. the command timed out): the stored create_order row is left to recovery
+            return None, e
 
-            LoggerService.log(main_msg="[SmartKasa] Getting receipts...")
-            receipts = self.smartkasa.get_invoices_all_pages()
-            
-            with open("receipts.json", "w", encoding="utf-8") as f:
-                json.dump(receipts, f, indent=4, ensure_ascii=False)
-            
-            # TODO: Mock data
-            date_from = "2025-06-01"
+        row["step"] = "add_payment"
+        try:
+            close_order_result = self.syrve.close_order(org_id, row["id"])
+            row["close_order_correlationId"] = close_order_result.get("correlationId")
+            self.syrve.wait_for_command(org_id, close_order_result.get("correlationId"))
+        except Exception as e:
+            return row, e
 
-            receipts = self.smartkasa.filter_receipts_by_date(receipts, date_from=date_from, date_to=None)
+        row["step"] = "close_order"
+        return row, None
+
+    @metrics.timed("sync.submit_order")
+    def _submit_order(self, order: dict, org_id: str, term_id: str) -> None:
+        """create_order -> add_payment -> close_order, each step confirmed through Syrve commands/status."""
+        receipt = order["receipt"]
+        LoggerService.log(main_msg=f"[Syrve] 📝 Creating order for receipt {receipt.get('id')}...")
+
+        result = self.syrve.create_order(org_id, term_id, order["items"], discountsInfo=order["discountsInfo"])
+        row = self._receipt_row(order, result, org_id)
+        receipt_id = row["id"]
+        add_receipt(**row)
+        LoggerService.log(main_msg=f"[Syrve] ✅ Order created", receipt_id=receipt_id,
+                          payload_id=payload_key("syrve_order", receipt_id), payload=self._order_payload(order, result))
+
+        try:
+            self.syrve.wait_for_command(org_id, result.get("correlationId"))
+        except SyrveCommandError:
+            # The order was never created in Syrve: release the receipt so a later sync creates it again
+            delete_receipt(receipt_id)
+            raise
+
+        LoggerService.log(main_msg=f"[SmartKasa] 💳 Payment type: {order['payment_type_kind']} (ID: {order['payment_type_id']}), Amount: {order['amount']}", receipt_id=receipt_id)
+        self._pay_order(org_id, receipt_id, order["payments"])
+        self._close_order(org_id, receipt_id)
+        metrics.inc("orders_synced_total")
+
+    def _pay_order(self, org_id: str, receipt_id: str, payments: list) -> None:
+        add_payment_result = self.syrve.add_payment(org_id, receipt_id, payments)
+        LoggerService.log(main_msg=f"[Syrve] ✅ Payment added to order {receipt_id}", msg_log_db=f"correlationId: {add_payment_result.get('correlationId')}", receipt_id=receipt_id)
+        update_receipt_state(receipt_id, "add_payment", add_payment_correlationId=add_payment_result.get("correlationId"))
+
+        self.syrve.wait_for_command(org_id, add_payment_result.get("correlationId"))
+
+    def _close_order(self, org_id: str, receipt_id: str) -> None:
+        close_order_result = self.syrve.close_order(org_id, receipt_id)
+        # Stored before waiting, so recovery waits on this command instead of closing the order a second time
+        update_receipt_state(receipt_id, "add_payment", close_order_correlationId=close_order_result.get("correlationId"))
 
-            LoggerService.log(main_msg=f"[SmartKasa] 🔎 Found {len(receipts)} receipts from {date_from}.")
-        
-            if not receipts:
-                print()
-                LoggerService.log(main_msg=f"[SmartKasa] ⚠️ No receipts found.", level=LOG_LEVEL_WARNING)
+        self.syrve.wait_for_command(org_id, close_order_result.get("correlationId"))
+        LoggerService.log(main_msg=f"[Syrve] ✅ Order {receipt_id} closed.", msg_log_db=f"correlationId: {close_order_result.get('correlationId')}", receipt_id=receipt_id)
+        update_receipt_state(receipt_id, "close_order")
+
+    @staticmethod
+    def _stored_payments(row: Receipt) -> list:
+        return [{
+            "paymentTypeId": row.payment_type_id,
+            "paymentTypeKind": row.payment_type,
+            "sum": float(row.amount or 0)
+        }]
+
+    @metrics.timed("recovery.resume_order")
+    def _resume_order(self, row: Receipt, default_org_id: str) -> None:
+        """Continues an order from its stored step: create_order -> add_payment -> close_order."""
+        receipt_id = row.id
+        close_correlation_id = row.close_order_correlationId
+        org_id = row.organization_id or default_org_id
+        LoggerService.log(main_msg=f"[Recovery] ▶️ Resuming order {receipt_id} (SK_ID: {row.sk_id}) from step {row.step}", receipt_id=receipt_id)
+
+        if row.step == "create_order":
+            if not row.payment_type_id:
+                LoggerService.log(main_msg=f"[Recovery][!] ⚠️ Order {receipt_id} has no stored payment type, it has to be finished manually.", level=LOG_LEVEL_WARNING, receipt_id=receipt_id)
+                # Out of the recovery queue, so the warning is logged once and not on every poll
+                update_receipt_state(receipt_id, "manual")
                 return
+            if not row.create_order_correlationId:
+                # Stored before correlationIds were kept: there is no command to wait on, polling it would never end
+                LoggerService.log(main_msg=f"[Recovery][!] ⚠️ Order {receipt_id} has no create_order correlationId, it has to be finished manually.", level=LOG_LEVEL_WARNING, receipt_id=receipt_id)
+                update_receipt_state(receipt_id, "manual")
+                return
+            try:
+                self.syrve.wait_for_command(org_id, row.create_order_correlationId)
+            except SyrveCommandError:
+                delete_receipt(receipt_id)
+                raise
+            # Backfill orders carry the payment in the create command
+            if row.add_payment_correlationId != row.create_order_correlationId:
+                self._pay_order(org_id, receipt_id, self._stored_payments(row))
+        elif row.add_payment_correlationId:
+            try:
+                self.syrve.wait_for_command(org_id, row.add_payment_correlationId)
+            except SyrveCommandError:
+                if row.add_payment_correlationId == row.create_order_correlationId:
+                    # A backfill order whose create command failed: it does not exist, release the receipt
+                    delete_receipt(receipt_id)
+                    raise
+                if not row.payment_type_id:
+                    raise
+                LoggerService.log(main_msg=f"[Recovery] Payment of order {receipt_id} failed, adding it again.", level=LOG_LEVEL_WARNING, receipt_id=receipt_id)
+                self._pay_order(org_id, receipt_id, self._stored_payments(row))
+                # A close sent before the payment failed cannot have closed the order with the new payment
+                close_correlation_id = None
 
-            LoggerService.log(main_msg=f"[Syrve] Authorization...")
+        if close_correlation_id:
+            try:
+                self.syrve.wait_for_command(org_id, close_correlation_id)
+            except SyrveCommandError:
+                LoggerService.log(main_msg=f"[Recovery] Closing order {receipt_id} failed, closing it again.", level=LOG_LEVEL_WARNING, receipt_id=receipt_id)
+            else:
+                LoggerService.log(main_msg=f"[Syrve] ✅ Order {receipt_id} closed.", msg_log_db=f"correlationId: {close_correlation_id}", receipt_id=receipt_id)
+                update_receipt_state(receipt_id, "close_order")
+                return
 
-            self.syrve.authenticate()
-            LoggerService.log(main_msg=f"[Syrve] ✅ Authorization successful.")
-            
-            org_id = self.syrve.get_organization_id()
-            term_id = self.syrve.get_terminal_group_id(org_id)
-            nomenclature = self.syrve.get_nomenclature(org_id)
+        self._close_order(org_id, receipt_id)
 
-            # TODO: Delete this line in production
-            # receipts = receipts[:1]
+    def resume_unfinished_orders(self) -> int:
+        """
+        Recovery pass: finishes orders that were created in Syrve but not paid/closed (e.g. after a crash or timeout).
+        Rows are read in batches of RESUME_BATCH_SIZE and resumed by the worker pool. Returns the number of resumed orders.
+        """
+        if not count_unfinished_receipts():
+            return 0
 
-            for idx, receipt in enumerate(receipts, 1):
-                print("="*60)
-                sk_receipt_id = receipt.get("id")
-                LoggerService.log(main_msg=f"[SmartKasa] ▶️ Processing receipt #{idx} | SK_ID: {sk_receipt_id} | Date: {receipt.get('created_at')}", msg_log_db=f"Receipt: {receipt}")
+        org_id, _ = self._connect_syrve()
+        # Rows stored before organization_id / account existed belong to the single-store setup only
+        include_legacy = self.name is None
+        resumed = failed = 0
+        last_id = None
+        with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as executor:
+            while True:
+                rows = get_unfinished_receipts(org_id, self.account, include_legacy, after_id=last_id, limit=RESUME_BATCH_SIZE)
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                futures = {executor.submit(self._resume_order, row, org_id): row for row in rows}
+                for future, row in futures.items():
+                    if future.exception():
+                        failed += 1
+                        metrics.inc("orders_resume_failed_total")
+                        LoggerService.log(main_msg=f"[Recovery] ❌ Failed to resume order {row.id}: {future.exception()}", level=LOG_LEVEL_ERROR, receipt_id=row.id)
+                    else:
+                        resumed += 1
+                        metrics.inc("orders_resumed_total")
 
-                if receipt_exists(sk_receipt_id):
-                    LoggerService.log(main_msg=f"[DB] Receipt already exists in DB: {sk_receipt_id}")
+        LoggerService.log(main_msg=f"[Recovery] 🔁 Resumed {resumed} unfinished orders ({failed} failed).")
+        return resumed
+
+    @metrics.timed("sync.process_receipt")
+    def _process_receipt(self, idx: int, receipt: dict, plan: MappingPlan, org_id: str, term_id: str) -> bool:
+        """Returns False if the receipt was skipped because none of its products is mapped."""
+        sk_receipt_id = receipt.get("id")
+        LoggerService.log(main_msg=f"[SmartKasa] ▶️ Processing receipt #{idx} | SK_ID: {sk_receipt_id} | Date: {receipt.get('created_at')}",
+                          payload_id=payload_key("sk_receipt", sk_receipt_id), payload=receipt)
+
+        metrics.inc("receipts_processed_total")
+        order = plan.build_order(receipt)
+        if not order:
+            return False
+
+        with metrics.span("sync.order_slot_wait"):
+            self._order_slots.acquire()
+        try:
+            self._submit_order(order, org_id, term_id)
+        finally:
+            self._order_slots.release()
+        return True
+
+    def _save_cursor(self, last_created_at: Optional[str]) -> None:
+        if last_created_at:
+            update_sync_cursor(self.account, last_created_at)
+            LoggerService.log(main_msg=f"[DB] Sync cursor moved to {last_created_at}")
+
+    def _skip_synced(self, receipts: Iterable[dict], window: dict) -> Iterator[dict]:
+        """
+        Drops receipts that already have a Receipt row (one query per DEDUP_BATCH_SIZE receipts) or were seen earlier in the stream.
+        `window` collects the newest created_at and the skipped count of everything that passed through.
+        """
+        seen = set()
+        for batch in chunked(receipts, DEDUP_BATCH_SIZE):
+            for receipt in batch:
+                created_at = receipt.get("created_at")
+                if created_at and (window["last_created_at"] is None or parse_datetime(created_at) > parse_datetime(window["last_created_at"])):
+                    window["last_created_at"] = created_at
+
+            with metrics.span("sync.dedup_query"):
+                synced = get_synced_sk_ids(receipt.get("id") for receipt in batch)
+            for receipt in batch:
+                sk_receipt_id = receipt.get("id")
+                if sk_receipt_id in synced or sk_receipt_id in seen:
+                    window["skipped"] += 1
+                    metrics.inc("receipts_skipped_total")
                     continue
+                seen.add(sk_receipt_id)
+                yield receipt
 
-                items = []
-                for item in receipt.get("items", []):
-                    product_id = item.get("product_id")
-                    quantity = item.get("quantity", 1)
-                    price = item.get("price", 0.0)
+    def backfill(self, date_from: str, date_to: Optional[str] = None, batch_size: int = BACKFILL_BATCH_SIZE, concurrency: int = BACKFILL_CONCURRENCY) -> None:
+        """
+        Bulk mode for historical receipts (ISO dates/datetimes, UTC, both ends inclusive; a date_to without a time
+        covers that whole day). Orders are created with the payment inline and closed, up to `concurrency` at a time.
+        Each Receipt row is stored as soon as its order is created; the later steps are written once per `batch_size`
+        receipts, so a crash inside a batch leaves rows for recovery to finish, never orders without a row.
+        The sync cursor is not touched.
+        """
+        since = metrics.snapshot()
+        run_started = time.perf_counter()
+        try:
+            if self.smartkasa.ensure_authenticated():
+                LoggerService.log(main_msg="[SmartKasa] ✅ Authorization successful.")
 
-                    smartkasa_product = self.smartkasa.get_product_by_id(product_id)
-                    if not smartkasa_product:
-                        LoggerService.log(main_msg=f"[SmartKasa][!] ❌ SmartKasa product not found: {product_id}", level=LOG_LEVEL_WARNING)
-                        continue
+            LoggerService.log(main_msg=f"[Backfill] Getting receipts from {date_from} to {date_to or 'now'}...")
+            receipts = self.smartkasa.get_invoices_all_pages(date_start=date_from[:10], date_end=date_to[:10] if date_to else None)
+            receipts = self.archive.tee(receipts)
+            receipts = self.smartkasa.filter_receipts_by_date(receipts, date_from=date_from, date_to=date_to)
+            window = {"last_created_at": None, "skipped": 0}
+            receipts = self._skip_synced(receipts, window)
 
-                    product_code = smartkasa_product.get("alter_number")
-                    LoggerService.log(main_msg=f"[SmartKasa] ➡️ Product: {smartkasa_product.get('alter_title')} (Code: {product_code}, Quantity: {quantity}, Price: {price})")
+            self._syrve_context = None
+            org_id, term_id = self._connect_syrve()
+            with metrics.span("sync.nomenclature"):
+                nomenclature = self.nomenclature_cache.get(self.syrve, org_id)
+            plan = self._mapping_plan(nomenclature)
 
-                    syrve_product = self.syrve.find_product_by_code(nomenclature, product_code)
+            started = time.monotonic()
+            seen = synced = failed = 0
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                for batch in chunked(receipts, batch_size):
+                    orders = []
+                    for receipt, future in [(receipt, executor.submit(plan.build_order, receipt)) for receipt in batch]:
+                        try:
+                            order = future.result()
+                        except Exception as e:
+                            # Products could not be looked up right now: the receipt is tried again by a later run
+                            failed += 1
+                            metrics.inc("receipts_failed_total")
+                            LoggerService.log(main_msg=f"[Backfill] ❌ Failed to map receipt {receipt.get('id')}: {e}", level=LOG_LEVEL_ERROR)
+                            continue
+                        if order:
+                            orders.append(order)
+                    futures = [executor.submit(self._submit_order_inline, order, org_id, term_id) for order in orders]
 
-                    if not syrve_product:
-                        LoggerService.log(main_msg=f"[Syrve][!] ❌ Product with code {product_code} not found in Syrve.", level=LOG_LEVEL_WARNING)
-                        continue
+                    rows = []
+                    for order, future in zip(orders, futures):
+                        row, error = future.result()
+                        if row:
+                            rows.append(row)
+                        if error:
+                            failed += 1
+                            metrics.inc("receipts_failed_total")
+                            LoggerService.log(main_msg=f"[Backfill] ❌ Failed to sync receipt {order['receipt'].get('id')}: {error}", level=LOG_LEVEL_ERROR)
+                        else:
+                            synced += 1
+                            metrics.inc("orders_synced_total")
+                    add_receipts(rows)
 
-                    items.append({
-                        "productId": syrve_product["id"],
-                        "type": "Product",
-                        "amount": quantity,
-                        "price": price
-                    })
+                    seen += len(batch)
+                    metrics.inc("receipts_processed_total", len(batch))
+                    elapsed = time.monotonic() - started
+                    LoggerService.log(main_msg=f"[Backfill] 📈 {seen} receipts ({synced} synced, {failed} failed, {window['skipped']} already synced) in {elapsed:.1f}s: {seen / elapsed:.1f} receipts/sec")
 
-                if not items:
-                    LoggerService.log(main_msg=f"[SmartKasa][!] ⚠️ No products matched for the order. {product_id}", level=LOG_LEVEL_WARNING)
-                    continue
+            LoggerService.log(main_msg=f"[Backfill] ✅ Done: {synced} orders created, {failed} failed.")
+            self._report_unmapped(plan)
+
+        except Exception as e:
+            LoggerService.log(main_msg=f"[X] ❌ Error in SyncBridge backfill: {e}", level=LOG_LEVEL_ERROR)
+        finally:
+            metrics.observe("span_seconds", time.perf_counter() - run_started, span="backfill.run")
+            if self.report_metrics:
+                report_metrics(since, f"Backfill of {self.account}")
+            LoggerService.flush()
+
+    def sync_last_receipts(self, full_backfill: bool = False):
+        self._syrve_context = None
+        since = metrics.snapshot()
+        run_started = time.perf_counter()
+        try:
+            if RESUME_ON_START:
+                self.resume_unfinished_orders()
+
+            if self.smartkasa.ensure_authenticated():
+                LoggerService.log(main_msg="[SmartKasa] ✅ Authorization successful.")
+
+            if PRODUCT_CACHE_WARM_UP and not self._warmed_up:
+                self._warmed_up = True
+                with metrics.span("sync.product_warm_up"):
+                    warmed = self.products.warm_up()
+                LoggerService.log(main_msg=f"[SmartKasa] Product cache warmed up with {warmed} products.")
+
+            date_start, date_from = self._get_sync_window(full_backfill)
+            mode = "full backfill" if full_backfill else "incremental"
+            LoggerService.log(main_msg=f"[SmartKasa] Getting receipts ({mode}) from {date_from}...")
+            receipts = self.smartkasa.get_invoices_all_pages(date_start=date_start)
+            receipts = self.archive.tee(receipts)
+            receipts = self.smartkasa.filter_receipts_by_date(receipts, date_from=date_from, date_to=None)
+            window = {"last_created_at": None, "skipped": 0}
+            receipts = self._skip_synced(receipts, window)
+
+            # Peek at the stream so Syrve is not touched when there is nothing new to sync
+            first_receipt = next(receipts, None)
+            if first_receipt is None:
+                LoggerService.log(main_msg=f"[SmartKasa] No new receipts found ({window['skipped']} already synced).")
+                self._save_cursor(window["last_created_at"])
+                return
+            receipts = chain([first_receipt], receipts)
+
+            org_id, term_id = self._connect_syrve()
+            with metrics.span("sync.nomenclature"):
+                nomenclature = self.nomenclature_cache.get(self.syrve, org_id)
+            plan = self._mapping_plan(nomenclature)
+
+            first_failed_at = None
+            unmatched = []  # created_at of receipts skipped because no product is mapped
+            processed = failed = 0
+            # Up to SYNC_WORKERS receipts are mapped and submitted at once; at most SYRVE_ORDER_CONCURRENCY
+            # of them are in create -> add_payment -> close, each waiting on its own Syrve command status
+            with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as executor:
+                pending = {}
+
+                def collect(return_when):
+                    nonlocal first_failed_at, failed
+                    done, _ = wait(pending, return_when=return_when)
+                    for future in done:
+                        receipt = pending.pop(future)
+                        if future.exception():
+                            failed += 1
+                            metrics.inc("receipts_failed_total")
+                            LoggerService.log(main_msg=f"[X] ❌ Failed to sync receipt {receipt.get('id')}: {future.exception()}", level=LOG_LEVEL_ERROR)
+                            if first_failed_at is None or parse_datetime(receipt["created_at"]) < parse_datetime(first_failed_at):
+                                first_failed_at = receipt["created_at"]
+                        elif not future.result():
+                            unmatched.append(receipt["created_at"])
+
+                for idx, receipt in enumerate(receipts, 1):
+                    processed = idx
+                    if len(pending) >= SYNC_WORKERS * 2:
+                        collect(FIRST_COMPLETED)
+                    pending[executor.submit(self._process_receipt, idx, receipt, plan, org_id, term_id)] = receipt
+
+                if pending:
+                    collect(ALL_COMPLETED)
+
+            self._report_unmapped(plan)
+            if unmatched:
+                # Unlike failed receipts these do not hold the cursor back (they may never match), so no later sync sees them again
+                first, last = min(unmatched, key=parse_datetime), max(unmatched, key=parse_datetime)
+                command = "main.py sync --tenants --full-backfill" if self.name else f"main.py backfill {first[:10]} --to {last[:10]}"
+                LoggerService.log(main_msg=f"[Mapping] ⚠️ {len(unmatched)} receipts from {first} to {last} were skipped and are behind the sync cursor now: "
+                                           f"map their products, then sync them with `{command}`.", level=LOG_LEVEL_WARNING)
+            LoggerService.log(main_msg=f"[SmartKasa] 🔎 Processed {processed} new receipts from {date_from} ({failed} failed, {window['skipped']} already synced). Product cache: {self.products.hits} hits, {self.products.misses} misses.")
 
-                discount_amount = receipt.get('discount_amount')
-                discountsInfo = None
-                if discount_amount and float(discount_amount) > 0:
-
-                    discount_type_id = os.getenv("SURVE_DISCOUT_TYPE_ID")
-                    discount_type = os.getenv("SURVE_DISCOUT_TYPE")
-
-                    discountsInfo = {
-                        "discounts": [
-                            {
-                                "discountTypeId": discount_type_id,
-                                "sum": float(discount_amount),
-                                "type": discount_type
-                            }
-                        ]
-                    }
-
-                payment_tx = receipt.get('payment_transactions', [{}])[0]
-                transaction_type_id = payment_tx.get('transaction_type_id')
-                amount = float(payment_tx.get('amount', 0))
-                
-                if transaction_type_id == 0:
-                    cash_pay_id = os.getenv("SURVE_TRANSACTION_TYPE_ID_CASH")
-                    payment_type_id = cash_pay_id
-                    payment_type_kind = "Card"
-                else:
-                    card_pay_id = os.getenv("SURVE_TRANSACTION_TYPE_ID_CARD")
-                    payment_type_id = card_pay_id
-                    payment_type_kind = "Card"
-                
-                payments = [{
-                    "paymentTypeId": payment_type_id,
-                    "paymentTypeKind": payment_type_kind,
-                    "sum": amount
-                }]
-                
-                LoggerService.log(main_msg=f"[SmartKasa] Discount: {discountsInfo}")
-
-                LoggerService.log(main_msg=f"[Syrve] 📝 Creating order...")
-
-                result = self.syrve.create_order(org_id, term_id, items, discountsInfo=discountsInfo)
-                order_info = result.get("orderInfo", {})
-                receipt_id = order_info.get("id")
-                add_receipt(
-                    id=receipt_id,
-                    created_at=order_info.get("timestamp"), 
-                    step="create_order",
-                    status=order_info.get("creationStatus"),
-                    data=str(order_info.get("order", {})),
-                    sk_created_at=receipt.get("created_at"),
-                    sk_status=receipt.get("state"),
-                    sk_id=receipt.get("id"),
-                    surve_id=order_info.get("id"),
-                    payment_type=payment_type_kind,
-                    amount=str(amount),
-                    discount=str(discount_amount),
-                    create_order_correlationId=result.get("correlationId"),
-                    add_payment_correlationId=add_payment_result.get("correlationId") if 'add_payment_result' in locals() else None,
-                    close_order_correlationId=close_order_result.get("correlationId") if 'close_order_result' in locals() else None
-                )
-                LoggerService.log(main_msg=f"[Syrve] ✅ Order created", msg_log_db=f"Order: {result}", receipt_id=receipt_id)
-
-                # Add payment
-                LoggerService.log(main_msg=f"[SmartKasa] 💳 Payment type: {payment_type_kind} (ID: {payment_type_id}), Amount: {amount}", receipt_id=receipt_id)
-                time.sleep(5)
-
-                add_payment_result = self.syrve.add_payment(org_id, result["orderInfo"]["id"], payments)
-                LoggerService.log(main_msg=f"[Syrve] ✅ Payment added to order {result['orderInfo']['id']}", msg_log_db=add_payment_result, receipt_id=receipt_id)
-                update_receipt_step(receipt_id, "add_payment")
-                update_add_payment_correlationId(receipt_id, add_payment_result.get("correlationId"))
-
-                close_order_result = self.syrve.close_order(org_id, result["orderInfo"]["id"])
-                LoggerService.log(main_msg=f"[Syrve] ✅ Order {result['orderInfo']['id']} closed.", msg_log_db=close_order_result, receipt_id=receipt_id)
-                print("="*60)
-                update_receipt_step(receipt_id, "close_order")
-                update_close_order_correlationId(receipt_id, close_order_result.get("correlationId"))
+            # The cursor never moves past a receipt that failed, so the next run fetches it again
+            last_created_at = window["last_created_at"]
+            if first_failed_at and last_created_at and parse_datetime(first_failed_at) < parse_datetime(last_created_at):
+                last_created_at = first_failed_at
+            self._save_cursor(last_created_at)
 
         except Exception as e:
             LoggerService.log(main_msg=f"[X] ❌ Error in SyncBridge: {e}", level=LOG_LEVEL_ERROR)
+            metrics.inc("sync_errors_total")
+        finally:
+            metrics.observe("span_seconds", time.perf_counter() - run_started, span="sync.run")
+            if self.report_metrics:
+                report_metrics(since, f"Sync of {self.account}")
+            LoggerService.flush()
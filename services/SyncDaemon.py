@@ -0,0 +1,43 @@
+import os
+import random
+import signal
+import threading
+import time
+
+from services.LoggerService import LoggerService
+from services.SyncBridge import SyncBridge
+
+# Seconds between the starts of two polls, plus a random 0..SYNC_POLL_JITTER so many daemons do not poll in lockstep
+SYNC_POLL_INTERVAL = float(os.getenv("SYNC_POLL_INTERVAL", "30"))
+SYNC_POLL_JITTER = float(os.getenv("SYNC_POLL_JITTER", "5"))
+
+
+class SyncDaemon:
+    """
+    Keeps a SyncBridge (or a TenantScheduler, which has the same sync_last_receipts interface) resident and polls
+    SmartKasa on an interval. Tokens are refreshed only before they expire, and nomenclature/product caches stay warm between polls.
+    """
+
+    def __init__(self, bridge: SyncBridge, interval: float = SYNC_POLL_INTERVAL, jitter: float = SYNC_POLL_JITTER):
+        self.bridge = bridge
+        self.interval = interval
+        self.jitter = jitter
+        self._stop = threading.Event()
+
+    def stop(self, *_) -> None:
+        LoggerService.log(main_msg="[Daemon] Stopping after the current poll...")
+        self._stop.set()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        LoggerService.log(main_msg=f"[Daemon] ▶️ Started, polling every {self.interval}s (+ up to {self.jitter}s jitter).")
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.bridge.sync_last_receipts()
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(0.0, self.interval - elapsed) + random.uniform(0, self.jitter))
+
+        LoggerService.log(main_msg="[Daemon] ⏹️ Stopped.")
+        LoggerService.flush()
@@ -1,47 +1,80 @@
 import os
-from dotenv import load_dotenv
-import requests
-from typing import Optional, Dict, Any, List
-
+import time
+from typing import Optional, Dict, Any, List, Union
+
+from core.http import HttpTransport
+from core.logger import LOG_LEVEL_DEBUG
+from core.metrics import metrics
+from core.nomenclature import Nomenclature
+from core.ratelimit import TokenBucket
+from core.tokens import AccessToken
 from services.LoggerService import LoggerService
 
-load_dotenv()
+# commands/status polling: first delay, backoff cap and overall timeout (seconds)
+SYRVE_COMMAND_POLL_INITIAL = float(os.getenv("SYRVE_COMMAND_POLL_INITIAL", "0.5"))
+SYRVE_COMMAND_POLL_MAX = float(os.getenv("SYRVE_COMMAND_POLL_MAX", "5"))
+SYRVE_COMMAND_TIMEOUT = float(os.getenv("SYRVE_COMMAND_TIMEOUT", "60"))
+# Requests per second allowed towards Syrve (0 disables the limiter) and the burst size
+SYRVE_RATE_LIMIT = float(os.getenv("SYRVE_RATE_LIMIT", "0"))
+SYRVE_RATE_BURST = float(os.getenv("SYRVE_RATE_BURST", "0"))
+# Syrve tokens live for an hour; they are refreshed TOKEN_REFRESH_MARGIN seconds before that
+SYRVE_TOKEN_TTL = float(os.getenv("SYRVE_TOKEN_TTL", "3600"))
+# Kept-alive connections to Syrve; match it to the number of order workers (SYRVE_ORDER_CONCURRENCY / BACKFILL_CONCURRENCY)
+SYRVE_POOL_SIZE = int(os.getenv("SYRVE_POOL_SIZE", "16"))
 
 class SyrveAPIError(Exception):
     """Custom exception for Syrve API errors."""
     pass
 
+class SyrveCommandError(SyrveAPIError):
+    """The command behind a correlationId finished with the Error state."""
+    pass
+
 class SyrveService:
-    BASE_URL = "https://api-eu.syrve.live/api/1"
+    BASE_URL = os.getenv("SYRVE_BASE_URL", "https://api-eu.syrve.live/api/1")
 
-    def __init__(self, api_login: str):
+    def __init__(self, api_login: str, rate_limiter: Optional[TokenBucket] = None, pool_size: int = SYRVE_POOL_SIZE):
         self.api_login = api_login
-        self.token: Optional[str] = None
-
-    def _post(self, endpoint: str, payload: dict) -> dict:
+        self.token = AccessToken(self.authenticate, SYRVE_TOKEN_TTL)
+        self.http = HttpTransport(
+            "Syrve",
+            pool_size=pool_size,
+            rate_limiter=rate_limiter or TokenBucket(SYRVE_RATE_LIMIT, SYRVE_RATE_BURST or None),
+            on_unauthorized=self.token.on_unauthorized
+        )
+
+    def _get_headers(self) -> Dict[str, str]:
+        return {"Content-Type": "application/json", **self.token.header()}
+
+    def _post(self, endpoint: str, payload: dict, idempotent: bool = True) -> dict:
+        """Order commands pass idempotent=False: they are not retried once the request may have reached Syrve."""
         url = f"{self.BASE_URL}/{endpoint}"
-        headers = {
-            "Authorization": f"Bearer {self.token}" if self.token else None,
-            "Content-Type": "application/json"
-        }
-        headers = {k: v for k, v in headers.items() if v is not None}
-        LoggerService.log(main_msg=f"[SyrveService]  post request to {url}", msg_log_db=f"Request to {url} with payload: {payload}")
-        response = requests.post(url, json=payload, headers=headers)
-        if not response.ok:
-            raise SyrveAPIError(f"API Error {response.status_code}: {response.text}")
-        return response.json()
-
-    def authenticate(self) -> None:
-        response = requests.post(f"{self.BASE_URL}/access_token", json={"apiLogin": self.api_login})
+        # commands/status polls are counted by the metrics only: one Log row per poll adds up to several per order
+        if endpoint != "commands/status":
+            LoggerService.log(main_msg=f"[SyrveService]  post request to {url}", level=LOG_LEVEL_DEBUG)
+        with metrics.span(f"syrve.{endpoint}"):
+            response = self.http.request("POST", url, json=payload, headers=self._get_headers, idempotent=idempotent)
+            if not response.ok:
+                raise SyrveAPIError(f"API Error {response.status_code}: {response.text}")
+            return response.json()
+
+    @metrics.timed("syrve.authenticate")
+    def authenticate(self) -> str:
+        """Logs in and returns a new token; self.token calls it when the current one expires or is rejected."""
+        response = self.http.request("POST", f"{self.BASE_URL}/access_token", json={"apiLogin": self.api_login}, refresh_on_401=False)
         if not response.ok:
             raise SyrveAPIError(f"Authentication failed: {response.text}")
-        data = response.json()
-        self.token = data.get("token")
-        if not self.token:
+        token = response.json().get("token")
+        if not token:
             raise SyrveAPIError("Token not found in authentication response.")
+        return token
+
+    def ensure_authenticated(self) -> bool:
+        """Authenticates only when there is no token or it expires within TOKEN_REFRESH_MARGIN. Returns True if it did."""
+        return self.token.ensure()
 
     def get_organization_id(self) -> str:
-        data = self._post("organizations", {"token": self.token})
+        data = self._post("organizations", {"token": self.token.value})
         orgs = data.get("organizations", [])
         if not orgs:
             raise SyrveAPIError("No organizations found.")
@@ -54,10 +87,16 @@ class SyrveService:
             raise SyrveAPIError("No terminal groups found.")
         return terminal_groups[0]["items"][0]["id"]
 
-    def get_nomenclature(self, organization_id: str) -> dict:
-        return self._post("nomenclature", {"organizationId": organization_id})
+    def get_nomenclature(self, organization_id: str, start_revision: Optional[int] = None) -> dict:
+        """With start_revision, Syrve returns the items only if there is a newer revision."""
+        payload = {"organizationId": organization_id}
+        if start_revision is not None:
+            payload["startRevision"] = start_revision
+        return self._post("nomenclature", payload)
 
-    def find_product_by_code(self, nomenclature: dict, code: str) -> Optional[dict]:
+    def find_product_by_code(self, nomenclature: Union[Nomenclature, dict], code: str) -> Optional[dict]:
+        if isinstance(nomenclature, Nomenclature):
+            return nomenclature.find_by_code(code)
         for product in nomenclature.get("products", []):
             if product.get("code") == code:
                 return product
@@ -67,8 +106,9 @@ class SyrveService:
                      organization_id: str,
                      terminal_group_id: str,
                      items: List[Dict[str, Any]],
-                     discountsInfo: dict = None) -> Dict[str, Any]:
-        
+                     discountsInfo: dict = None,
+                     payments: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """payments are added inline to the order, which saves the separate add_payment call."""
         order_payload = {
             "organizationId": organization_id,
             "terminalGroupId": terminal_group_id,
@@ -80,8 +120,11 @@ class SyrveService:
         if discountsInfo:
             order_payload["order"]["discountsInfo"] = discountsInfo
 
+        if payments:
+            order_payload["order"]["payments"] = payments
+
         
-        data = self._post("order/create", order_payload)
+        data = self._post("order/create", order_payload, idempotent=False)
         return {
             "correlationId": data.get("correlationId"),
             "orderInfo": data.get("orderInfo")
@@ -97,10 +140,7 @@ class SyrveService:
             "payments": payments
         }
 
-        # TODO: Delete this in production
-        print(f"[SyrveService] Adding payment for order {order_id} with payload: {payload}")
-        
-        return self._post("order/add_payments", payload)
+        return self._post("order/add_payments", payload, idempotent=False)
     
     def close_order(self,
                 organization_id: str,
@@ -109,15 +149,48 @@ class SyrveService:
             "organizationId" : organization_id,
             "orderId" : order_id
         }
-        return self._post("order/close", payload)
+        return self._post("order/close", payload, idempotent=False)
     
+    def get_command_status(self,
+                organization_id: str,
+                correlation_id: str) -> Dict[str, Any]:
+        payload = {
+            "organizationId": organization_id,
+            "correlationId": correlation_id
+        }
+        return self._post("commands/status", payload)
+
+    @metrics.timed("syrve.wait_for_command")
+    def wait_for_command(self,
+                organization_id: str,
+                correlation_id: str,
+                timeout: float = SYRVE_COMMAND_TIMEOUT) -> Dict[str, Any]:
+        """Polls commands/status with exponential backoff until the command succeeds. Raises on Error or timeout."""
+        delay = SYRVE_COMMAND_POLL_INITIAL
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.get_command_status(organization_id, correlation_id)
+            state = status.get("state")
+            if state == "Success":
+                return status
+            if state == "Error":
+                raise SyrveCommandError(f"Command {correlation_id} failed: {status.get('exception')}")
+            if time.monotonic() + delay > deadline:
+                raise SyrveAPIError(f"Command {correlation_id} is still {state} after {timeout}s")
+            with metrics.span("syrve.command_poll_sleep"):
+                time.sleep(delay)
+            delay = min(delay * 2, SYRVE_COMMAND_POLL_MAX)
+
 # Example usage from another service
 if __name__ == "__main__":
+    from core.config import load_config
+    load_config()
+
     api_login = os.getenv("SYRVE_API_LOGIN")
     syrve = SyrveService(api_login=api_login)
 
     try:
-        syrve.authenticate()
+        syrve.ensure_authenticated()
         org_id = syrve.get_organization_id()
         term_id = syrve.get_terminal_group_id(org_id)
 
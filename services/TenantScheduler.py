@@ -0,0 +1,89 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from core.logger import LOG_LEVEL_ERROR
+from core.metrics import metrics
+from services.LoggerService import LoggerService
+from services.NomenclatureCache import NomenclatureCache
+from services.SyncBridge import SyncBridge, report_metrics
+from services.SyrveService import SyrveService
+
+SYNC_TENANTS_FILE = os.getenv("SYNC_TENANTS_FILE", "tenants.json")
+# Tenants synced at the same time; each of them uses its own SYNC_WORKERS pool
+TENANT_CONCURRENCY = max(1, int(os.getenv("TENANT_CONCURRENCY", "4")))
+
+
+def load_tenants(path: Optional[str] = None) -> List[dict]:
+    """
+    Reads the tenant registry (SYNC_TENANTS_FILE unless `path` is given): a JSON list of
+    {"name", "smartkasa": {...}, "syrve": {...}}. "smartkasa" takes the SmartKasaService arguments, "syrve" takes
+    api_login and optional organization_id / terminal_group_id.
+    Every tenant needs its own SmartKasa login: the receipts API has no store filter, so two tenants on one login
+    would read the same receipts and post each of them twice.
+    """
+    path = path or SYNC_TENANTS_FILE
+    with open(path, "r", encoding="utf-8") as f:
+        tenants = json.load(f)
+
+    names = [tenant.get("name") for tenant in tenants]
+    if not all(names) or len(set(names)) != len(names):
+        raise ValueError(f"Every tenant in {path} needs a unique name.")
+    logins = [tenant["smartkasa"]["phone_number"] for tenant in tenants]
+    shared = sorted({login for login in logins if logins.count(login) > 1})
+    if shared:
+        raise ValueError(f"Tenants in {path} share the SmartKasa login(s) {', '.join(shared)}; every tenant needs its own.")
+    return tenants
+
+
+class TenantScheduler:
+    """
+    Syncs many SmartKasa store -> Syrve organization/terminal pairs from one process.
+    Every tenant has its own SmartKasa login (see load_tenants); tenants with the same Syrve api_login share the
+    service (token, rate limit). All of them share one NomenclatureCache, so an organization's catalogue is loaded
+    once. Every cycle syncs each tenant once, at most TENANT_CONCURRENCY at a time.
+    """
+
+    def __init__(self, tenants: List[dict], concurrency: int = TENANT_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self.nomenclature_cache = NomenclatureCache()
+
+        syrve_services: Dict[str, SyrveService] = {}
+
+        self.bridges: List[SyncBridge] = []
+        for tenant in tenants:
+            smartkasa_conf = tenant["smartkasa"]
+            syrve_conf = tenant["syrve"]
+
+            syrve_key = syrve_conf["api_login"]
+            if syrve_key not in syrve_services:
+                syrve_services[syrve_key] = SyrveService(api_login=syrve_key)
+
+            self.bridges.append(SyncBridge(
+                smartkasa_conf=smartkasa_conf,
+                syrve_conf=syrve_conf,
+                name=tenant["name"],
+                syrve=syrve_services[syrve_key],
+                nomenclature_cache=self.nomenclature_cache
+            ))
+            self.bridges[-1].report_metrics = False
+
+    def _sync_tenant(self, bridge: SyncBridge, full_backfill: bool = False) -> None:
+        LoggerService.log(main_msg=f"[Tenant] ▶️ Syncing {bridge.name}...")
+        bridge.sync_last_receipts(full_backfill=full_backfill)
+
+    def sync_last_receipts(self, full_backfill: bool = False) -> None:
+        """One cycle over all tenants; same interface as SyncBridge, so SyncDaemon can drive either."""
+        since = metrics.snapshot()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(self._sync_tenant, bridge, full_backfill): bridge for bridge in self.bridges}
+            for future, bridge in futures.items():
+                if future.exception():
+                    LoggerService.log(main_msg=f"[Tenant] ❌ Sync of {bridge.name} failed: {future.exception()}", level=LOG_LEVEL_ERROR)
+        report_metrics(since, f"Sync of {len(self.bridges)} tenants")
+        LoggerService.flush()
+
+    def resume_unfinished_orders(self) -> int:
+        """Recovery pass for every tenant, one after another. Returns the number of resumed orders."""
+        return sum(bridge.resume_unfinished_orders() for bridge in self.bridges)
@@ -0,0 +1,14 @@
+import pytest
+
+from services.DBService import db, init_db
+from services.LoggerService import LoggerService
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A fresh, migrated SQLite database for the test."""
+    path = str(tmp_path / "syncbridge.db")
+    init_db(path)
+    yield path
+    LoggerService.flush()
+    db.close()
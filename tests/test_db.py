@@ -0,0 +1,60 @@
+from services.DBService import MIGRATIONS, Payload, Receipt, add_receipt, add_receipts, db, get_unfinished_receipts, init_db, payload_row, prune_payloads
+
+
+def receipt_row(receipt_id, step="create_order", organization_id="org", account="store-a"):
+    return {
+        "id": receipt_id,
+        "created_at": "0",
+        "step": step,
+        "status": "InProgress",
+        "data": f"sk_receipt:{receipt_id}",
+        "sk_created_at": "2025-06-01T00:00:00Z",
+        "sk_status": "done",
+        "sk_id": f"sk-{receipt_id}",
+        "surve_id": receipt_id,
+        "organization_id": organization_id,
+        "account": account,
+    }
+
+
+def columns(table):
+    return {column.name for column in db.get_columns(table)}
+
+
+def test_migrations_bring_an_old_database_up_to_date(database):
+    db.execute_sql('DROP INDEX "log_payload_id"')
+    db.execute_sql("ALTER TABLE log DROP COLUMN payload_id")
+    db.execute_sql("ALTER TABLE receipt DROP COLUMN account")
+    db.pragma("user_version", 2)
+    db.close()
+
+    init_db(database)
+
+    assert "payload_id" in columns("log")
+    assert "account" in columns("receipt")
+    # A real column index, not one on the string literal "payload_id"
+    assert [row[2] for row in db.execute_sql("PRAGMA index_info('log_payload_id')")] == ["payload_id"]
+    assert db.pragma("user_version") == len(MIGRATIONS)
+
+
+def test_unfinished_receipts_are_scoped_to_the_store(database):
+    add_receipt(**receipt_row("a1", account="store-a"))
+    add_receipt(**receipt_row("b1", account="store-b"))
+    add_receipt(**receipt_row("a2", step="close_order", account="store-a"))
+    add_receipt(**receipt_row("legacy", organization_id=None, account=None))
+
+    assert [row.id for row in get_unfinished_receipts("org", "store-a")] == ["a1"]
+    assert [row.id for row in get_unfinished_receipts("org", "store-b")] == ["b1"]
+    assert [row.id for row in get_unfinished_receipts("org", "store-a", include_legacy=True)] == ["a1", "legacy"]
+    assert Receipt.select().count() == 4
+
+
+def test_prune_payloads_keeps_the_orders_sent_for_stored_receipts(database):
+    add_receipts([receipt_row("a1")], [
+        payload_row("sk_receipt:a1", {}),
+        payload_row("syrve_order:a1", {}),
+        payload_row("syrve_order:gone", {})
+    ])
+
+    assert prune_payloads() == 1
+    assert sorted(payload.key for payload in Payload.select()) == ["sk_receipt:a1", "syrve_order:a1"]
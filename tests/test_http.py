@@ -0,0 +1,102 @@
+import pytest
+import requests
+
+from core.http import CircuitBreaker, CircuitOpenError, HttpTransport
+
+URL = "http://syrve.test/api/1/order/create"
+ENDPOINT = "/api/1/order/create"
+
+
+def make_response(status):
+    response = requests.Response()
+    response.status_code = status
+    return response
+
+
+class ScriptedSession:
+    """Stands in for requests.Session: returns (or raises) the scripted outcomes in order."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return make_response(outcome)
+
+
+def half_open_transport(*outcomes, on_unauthorized=lambda response: None):
+    """A transport whose breaker for ENDPOINT is open with the reset timeout already passed."""
+    transport = HttpTransport("Test", on_unauthorized=on_unauthorized, max_retries=0)
+    transport.session = ScriptedSession(*outcomes)
+    breaker = transport._breakers[ENDPOINT] = CircuitBreaker(threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    return transport, breaker
+
+
+def test_breaker_lets_one_trial_through_and_closes_on_success():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.before_request("x") is False
+    breaker.record_failure()
+
+    assert breaker.before_request("x") is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("x")
+    breaker.record_success()
+    assert breaker.before_request("x") is False
+
+
+def test_breaker_reopens_when_the_trial_fails():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("x")
+
+    breaker.reset_timeout = 0
+    assert breaker.before_request("x") is True
+    breaker.record_failure()
+    breaker.reset_timeout = 60
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("x")
+
+
+def test_half_open_trial_answered_with_401_refreshes_and_closes():
+    refreshed = []
+    transport, breaker = half_open_transport(401, 200, 200, on_unauthorized=refreshed.append)
+
+    assert transport.request("POST", URL).status_code == 200
+    assert len(refreshed) == 1
+    assert transport.request("POST", URL).status_code == 200
+    assert breaker.before_request("x") is False
+
+
+def test_half_open_trial_is_released_when_the_refresh_raises():
+    def on_unauthorized(response):
+        raise RuntimeError("auth down")
+
+    transport, breaker = half_open_transport(401, 200, on_unauthorized=on_unauthorized)
+    with pytest.raises(RuntimeError):
+        transport.request("POST", URL)
+
+    assert transport.request("POST", URL, refresh_on_401=False).status_code == 200
+    assert breaker.before_request("x") is False
+
+
+def test_half_open_trial_is_released_on_other_request_errors():
+    transport, breaker = half_open_transport(requests.exceptions.ChunkedEncodingError("broken"), 200)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        transport.request("GET", URL)
+
+    assert transport.request("GET", URL).status_code == 200
+    assert breaker.before_request("x") is False
+
+
+def test_non_idempotent_request_is_not_retried_after_5xx():
+    transport = HttpTransport("Test", max_retries=3)
+    transport.session = ScriptedSession(503, 200)
+    assert transport.request("POST", URL, idempotent=False).status_code == 503
+    assert transport.session.calls == 1
@@ -0,0 +1,111 @@
+import pickle
+
+import pytest
+
+from core.mapping import DiscountMapping, MappingConfig, MappingPlan, PaymentMapping
+from core.nomenclature import Nomenclature
+from services.ProductCache import ProductCache
+from services.SmartKasaService import SmartKasaAPIError
+
+CONFIG = MappingConfig(
+    cash=PaymentMapping("cash", "Card"),
+    card=PaymentMapping("card", "Card"),
+    discount=DiscountMapping("discount", "RMS")
+)
+NOMENCLATURE = Nomenclature({"revision": 1, "products": [{"id": "syrve-1", "code": "A1"}, {"id": "syrve-2", "code": "A2"}]})
+
+
+def receipt(*product_ids, transaction_type_id=1, discount_amount=None):
+    return {
+        "id": "sk-1",
+        "items": [{"product_id": product_id, "quantity": 2, "price": 5.0} for product_id in product_ids],
+        "discount_amount": discount_amount,
+        "payment_transactions": [{"transaction_type_id": transaction_type_id, "amount": "10.0"}]
+    }
+
+
+class Resolver:
+    """resolve stand-in: answers from `table`, raising for the products listed in `failing`."""
+
+    def __init__(self, table, failing=()):
+        self.table = table
+        self.failing = set(failing)
+        self.calls = []
+
+    def __call__(self, product_id):
+        self.calls.append(product_id)
+        if product_id in self.failing:
+            raise SmartKasaAPIError(f"503 for {product_id}")
+        return self.table.get(product_id)
+
+
+def test_stored_mappings_missing_from_nomenclature_are_resolved_again():
+    resolve = Resolver({"2": "syrve-2"})
+    plan = MappingPlan(CONFIG, NOMENCLATURE, {"1": "syrve-1", "2": "deleted"}, resolve)
+
+    assert plan.translate(1) == "syrve-1"
+    assert plan.translate(2) == "syrve-2"
+    assert resolve.calls == ["2"]
+
+
+def test_definitive_answers_are_memoized():
+    resolve = Resolver({"1": "syrve-1"})
+    plan = MappingPlan(CONFIG, NOMENCLATURE, {}, resolve)
+
+    for _ in range(2):
+        assert plan.translate(1) == "syrve-1"
+        assert plan.translate(9) is None
+
+    assert resolve.calls == ["1", "9"]
+
+
+def test_failed_lookup_is_not_memoized_and_fails_the_receipt():
+    resolve = Resolver({"1": "syrve-1", "2": "syrve-2"}, failing={"2"})
+    plan = MappingPlan(CONFIG, NOMENCLATURE, {}, resolve)
+
+    with pytest.raises(SmartKasaAPIError):
+        plan.build_order(receipt(1, 2))
+    assert "2" not in plan.products
+    assert not plan.unmapped
+
+    resolve.failing.clear()
+    order = plan.build_order(receipt(1, 2))
+    assert [item["productId"] for item in order["items"]] == ["syrve-1", "syrve-2"]
+
+
+def test_build_order():
+    plan = MappingPlan(CONFIG, NOMENCLATURE, {"1": "syrve-1"}, Resolver({}))
+
+    order = plan.build_order(receipt(1, 9, transaction_type_id=0, discount_amount="1.5"))
+
+    assert order["items"] == [{"productId": "syrve-1", "type": "Product", "amount": 2, "price": 5.0}]
+    assert order["payment_type_id"] == "cash"
+    assert order["payments"] == [{"paymentTypeId": "cash", "paymentTypeKind": "Card", "sum": 10.0}]
+    assert order["discountsInfo"]["discounts"][0]["sum"] == 1.5
+    assert plan.unmapped == {"9": 1}
+
+    assert plan.build_order(receipt(9)) is None
+    assert plan.unmatched_receipts == 1
+
+
+def test_pickled_plan_knows_only_resolved_products():
+    plan = MappingPlan(CONFIG, NOMENCLATURE, {"1": "syrve-1"}, Resolver({"2": "syrve-2"}))
+    plan.translate(2)
+
+    copy = pickle.loads(pickle.dumps(plan))
+
+    assert copy.products == {"1": "syrve-1", "2": "syrve-2"}
+    assert copy.translate(3) is None
+
+
+class FailingSmartKasa:
+    def get_product_by_id(self, product_id, raise_on_error=False):
+        raise SmartKasaAPIError("SmartKasa API error 503")
+
+
+def test_product_cache_raises_transient_errors_on_request(database):
+    cache = ProductCache(FailingSmartKasa())
+
+    assert cache.get("1") is None
+    with pytest.raises(SmartKasaAPIError):
+        cache.get("1", raise_on_error=True)
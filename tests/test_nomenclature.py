@@ -0,0 +1,39 @@
+from services.NomenclatureCache import NomenclatureCache
+
+CATALOGUE = {"revision": 2, "products": [{"id": "syrve-1", "code": "A1"}, {"id": "syrve-2", "code": "A2"}]}
+
+
+class FakeSyrve:
+    """get_nomenclature stand-in: answers startRevision requests with `delta`, full requests with `full`."""
+
+    def __init__(self, full, delta=None):
+        self.full = full
+        self.delta = delta
+        self.requests = []
+
+    def get_nomenclature(self, organization_id, start_revision=None):
+        self.requests.append(start_revision)
+        return self.full if start_revision is None else self.delta
+
+
+def test_newer_revision_is_downloaded_once(database):
+    cache = NomenclatureCache(check_interval=0)
+    assert len(cache.get(FakeSyrve(CATALOGUE), "org")) == 2
+
+    syrve = FakeSyrve(CATALOGUE, delta={"revision": 2})
+    assert len(cache.get(syrve, "org")) == 2
+    assert syrve.requests == [2]
+
+
+def test_missing_revision_downloads_the_catalogue_again(database):
+    cache = NomenclatureCache(check_interval=0)
+    cache.get(FakeSyrve(CATALOGUE), "org")
+
+    updated = {"products": CATALOGUE["products"] + [{"id": "syrve-3", "code": "A3"}]}
+    syrve = FakeSyrve(updated, delta={})
+    nomenclature = cache.get(syrve, "org")
+
+    assert syrve.requests == [2, None]
+    assert nomenclature.find_by_code("A3")["id"] == "syrve-3"
+    # The snapshot without a revision is refreshed on every check from now on
+    assert len(NomenclatureCache(check_interval=0).get(FakeSyrve(CATALOGUE), "org")) == 2
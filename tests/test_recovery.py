@@ -0,0 +1,134 @@
+import pytest
+
+from services.DBService import Receipt, add_receipts, get_unfinished_receipts
+from services.SyncBridge import SyncBridge
+from services.SyrveService import SyrveAPIError, SyrveCommandError
+
+ORDER = {
+    "receipt": {"id": "sk-1", "created_at": "2025-06-01T10:00:00Z", "state": "done"},
+    "items": [{"productId": "p-1", "type": "Product", "amount": 1, "price": 10.0}],
+    "discountsInfo": None,
+    "discount_amount": None,
+    "payments": [{"paymentTypeId": "card", "paymentTypeKind": "Card", "sum": 10.0}],
+    "payment_type_id": "card",
+    "payment_type_kind": "Card",
+    "amount": 10.0
+}
+
+
+class FakeSyrve:
+    """Syrve stand-in: commands end as scripted per correlationId ("ok", "error" or "timeout")."""
+
+    def __init__(self, **outcomes):
+        self.outcomes = outcomes
+        self.calls = []
+
+    def create_order(self, org_id, term_id, items, discountsInfo=None, payments=None):
+        self.calls.append("create_order")
+        return {"correlationId": "create", "orderInfo": {"id": "order-1", "timestamp": 1, "creationStatus": "InProgress"}}
+
+    def add_payment(self, org_id, order_id, payments):
+        self.calls.append("add_payment")
+        return {"correlationId": "pay"}
+
+    def close_order(self, org_id, order_id):
+        self.calls.append("close_order")
+        return {"correlationId": "close"}
+
+    def wait_for_command(self, org_id, correlation_id):
+        # Every command is confirmed only after its Receipt row is stored
+        assert Receipt.get_or_none(Receipt.id == "order-1") is not None
+        outcome = self.outcomes.get(correlation_id, "ok")
+        if outcome == "error":
+            raise SyrveCommandError(f"{correlation_id} failed")
+        if outcome == "timeout":
+            raise SyrveAPIError(f"{correlation_id} timed out")
+        return {"state": "Success"}
+
+
+def make_bridge(syrve):
+    return SyncBridge(smartkasa_conf={}, syrve_conf={}, name="store-a", smartkasa=object(), syrve=syrve, products=object())
+
+
+def stored_row():
+    return Receipt.get_or_none(Receipt.id == "order-1")
+
+
+def test_backfill_order_is_stored_before_its_commands_are_confirmed(database):
+    syrve = FakeSyrve()
+    row, error = make_bridge(syrve)._submit_order_inline(ORDER, "org", "term")
+
+    assert error is None and row["step"] == "close_order"
+    assert syrve.calls == ["create_order", "close_order"]
+    assert stored_row().account == "store-a"
+
+
+def test_backfill_create_timeout_is_left_at_create_order(database):
+    row, error = make_bridge(FakeSyrve(create="timeout"))._submit_order_inline(ORDER, "org", "term")
+
+    assert row is None and isinstance(error, SyrveAPIError)
+    stored = stored_row()
+    assert stored.step == "create_order"
+    assert stored.create_order_correlationId == stored.add_payment_correlationId == "create"
+
+
+def test_recovery_releases_a_backfill_order_whose_create_failed(database):
+    make_bridge(FakeSyrve(create="timeout"))._submit_order_inline(ORDER, "org", "term")
+
+    syrve = FakeSyrve(create="error")
+    with pytest.raises(SyrveCommandError):
+        make_bridge(syrve)._resume_order(stored_row(), "org")
+    assert stored_row() is None
+    assert syrve.calls == []
+
+
+def test_recovery_closes_a_backfill_order_without_paying_it_again(database):
+    make_bridge(FakeSyrve(create="timeout"))._submit_order_inline(ORDER, "org", "term")
+
+    syrve = FakeSyrve()
+    make_bridge(syrve)._resume_order(stored_row(), "org")
+    assert syrve.calls == ["close_order"]
+    assert stored_row().step == "close_order"
+
+
+def test_recovery_pays_a_live_sync_order_left_at_create_order(database):
+    bridge = make_bridge(FakeSyrve(create="timeout"))
+    with pytest.raises(SyrveAPIError):
+        bridge._submit_order(ORDER, "org", "term")
+
+    syrve = FakeSyrve()
+    make_bridge(syrve)._resume_order(stored_row(), "org")
+    assert syrve.calls == ["add_payment", "close_order"]
+    assert stored_row().step == "close_order"
+
+
+def test_recovery_hands_orders_without_a_create_correlation_id_to_manual_handling(database):
+    make_bridge(FakeSyrve(create="timeout"))._submit_order_inline(ORDER, "org", "term")
+    Receipt.update(create_order_correlationId=None, add_payment_correlationId=None).execute()
+
+    syrve = FakeSyrve()
+    make_bridge(syrve)._resume_order(stored_row(), "org")
+    assert syrve.calls == []
+    assert stored_row().step == "manual"
+    assert not get_unfinished_receipts("org", "store-a")
+
+
+def test_recovery_waits_on_a_close_that_timed_out_instead_of_closing_again(database):
+    with pytest.raises(SyrveAPIError):
+        make_bridge(FakeSyrve(close="timeout"))._submit_order(ORDER, "org", "term")
+    assert (stored_row().step, stored_row().close_order_correlationId) == ("add_payment", "close")
+
+    syrve = FakeSyrve()
+    make_bridge(syrve)._resume_order(stored_row(), "org")
+    assert syrve.calls == []
+    assert stored_row().step == "close_order"
+
+
+def test_recovery_closes_again_when_the_stored_close_failed(database):
+    row, error = make_bridge(FakeSyrve(close="timeout"))._submit_order_inline(ORDER, "org", "term")
+    add_receipts([row])
+
+    syrve = FakeSyrve(close="error")
+    with pytest.raises(SyrveCommandError):
+        make_bridge(syrve)._resume_order(stored_row(), "org")
+    assert syrve.calls == ["close_order"]
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+from services.ReceiptReplay import ReceiptReplay
+
+ITEMS = [{"productId": "syrve-1", "type": "Product", "amount": 2, "price": 5.0}]
+
+
+def replayed(items):
+    return {
+        "sk_id": "sk-1",
+        "sk_created_at": "2025-06-01T10:00:00Z",
+        "unmapped": [],
+        "order": {"items": len(items), "payment_type_id": "card", "amount": "10.0", "discount": "None"},
+        "items": items
+    }
+
+
+STORED = SimpleNamespace(surve_id="order-1", step="close_order", payment_type_id="card", amount="10.0", discount="None")
+
+
+def test_same_order_is_unchanged():
+    status, entry = ReceiptReplay._diff(replayed(ITEMS), STORED, {"request": {"items": ITEMS}})
+
+    assert status == "unchanged"
+    assert "changes" not in entry
+
+
+def test_remapped_product_is_reported():
+    remapped = [{**ITEMS[0], "productId": "syrve-2"}]
+
+    status, entry = ReceiptReplay._diff(replayed(remapped), STORED, {"request": {"items": ITEMS}})
+
+    assert status == "changed"
+    assert entry["changes"] == {"items": [
+        [{"productId": "syrve-1", "amount": 2, "price": 5.0}],
+        [{"productId": "syrve-2", "amount": 2, "price": 5.0}]
+    ]}
+
+
+def test_orders_without_a_sent_payload_compare_the_receipt_columns():
+    assert ReceiptReplay._diff(replayed(ITEMS), STORED)[0] == "unchanged"
+    assert ReceiptReplay._diff(replayed(ITEMS), SimpleNamespace(**{**vars(STORED), "amount": "12.0"}))[0] == "changed"
@@ -0,0 +1,22 @@
+from services.SmartKasaService import SmartKasaService
+
+RECEIPTS = [
+    {"id": "before", "created_at": "2025-05-31T23:59:59Z"},
+    {"id": "first", "created_at": "2025-06-01T00:00:00Z"},
+    {"id": "last-day", "created_at": "2025-06-30T12:00:00Z"},
+    {"id": "after", "created_at": "2025-07-01T00:00:00Z"},
+]
+
+
+def filtered(date_from, date_to):
+    smartkasa = SmartKasaService(phone_number="1", password="x", api_key="k")
+    return [receipt["id"] for receipt in smartkasa.filter_receipts_by_date(RECEIPTS, date_from=date_from, date_to=date_to)]
+
+
+def test_date_to_covers_the_whole_day():
+    assert filtered("2025-06-01", "2025-06-30") == ["first", "last-day"]
+
+
+def test_datetime_bounds_are_inclusive():
+    assert filtered("2025-06-01T00:00:00", "2025-06-30T12:00:00") == ["first", "last-day"]
+    assert filtered("2025-06-01T00:00:01", "2025-06-30T11:59:59") == []
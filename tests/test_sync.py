@@ -0,0 +1,105 @@
+import services.SyncBridge as sync_bridge
+from core.nomenclature import Nomenclature
+from services.DBService import add_receipt, get_sync_cursor, save_product_mapping, update_sync_cursor
+from services.SmartKasaService import SmartKasaService
+from services.SyncBridge import SyncBridge
+
+NOMENCLATURE = Nomenclature({"revision": 1, "products": [{"id": "syrve-1", "code": "A1"}]})
+
+
+def receipt(receipt_id, created_at, product_id="1"):
+    return {"id": receipt_id, "created_at": created_at, "state": "done", "items": [{"product_id": product_id, "quantity": 1, "price": 10.0}],
+            "payment_transactions": [{"transaction_type_id": 1, "amount": "10.0"}]}
+
+
+class FakeSmartKasa:
+    """Serves `receipts` from any date_start; the date filter is SmartKasaService's own."""
+    filter_receipts_by_date = SmartKasaService.filter_receipts_by_date
+
+    def __init__(self, receipts):
+        self.receipts = receipts
+        self.date_starts = []
+
+    def ensure_authenticated(self):
+        return False
+
+    def get_invoices_all_pages(self, date_start=None, date_end=None):
+        self.date_starts.append(date_start)
+        return iter(self.receipts)
+
+
+class FakeSyrve:
+    api_login = "login"
+
+    def ensure_authenticated(self):
+        return False
+
+
+class FakeNomenclatureCache:
+    def get(self, syrve, organization_id):
+        return NOMENCLATURE
+
+
+class NoProducts:
+    hits = misses = 0
+
+    def get(self, product_id, raise_on_error=False):
+        return None
+
+
+def make_bridge(receipts, failing=()):
+    bridge = SyncBridge(smartkasa_conf={}, syrve_conf={"organization_id": "org", "terminal_group_id": "term"}, name="store-a",
+                        smartkasa=FakeSmartKasa(receipts), syrve=FakeSyrve(), products=NoProducts(),
+                        nomenclature_cache=FakeNomenclatureCache())
+    bridge.report_metrics = False
+    submitted = []
+
+    def submit_order(order, org_id, term_id):
+        if order["receipt"]["id"] in failing:
+            raise RuntimeError("Syrve is down")
+        submitted.append(order["receipt"]["id"])
+        row = bridge._receipt_row(order, {"orderInfo": {"id": f"order-{order['receipt']['id']}", "timestamp": 1, "creationStatus": "Success"}}, org_id, step="close_order")
+        add_receipt(**row)
+
+    bridge._submit_order = submit_order
+    bridge.submitted = submitted
+    return bridge
+
+
+def test_window_starts_the_overlap_before_the_cursor(database, monkeypatch):
+    monkeypatch.setattr(sync_bridge, "SYNC_OVERLAP_MINUTES", 10)
+    update_sync_cursor("store-a", "2025-06-02T00:05:00Z")
+
+    assert make_bridge([])._get_sync_window() == ("2025-06-01", "2025-06-01T23:55:00")
+    assert make_bridge([])._get_sync_window(full_backfill=True) == (sync_bridge.SYNC_START_DATE, f"{sync_bridge.SYNC_START_DATE}T00:00:00")
+
+
+def test_cursor_moves_to_the_newest_receipt(database):
+    save_product_mapping("1", "A1", "syrve-1")
+    bridge = make_bridge([receipt("r1", "2025-06-01T10:00:00Z"), receipt("r2", "2025-06-01T11:00:00Z")])
+
+    bridge.sync_last_receipts()
+
+    assert sorted(bridge.submitted) == ["r1", "r2"]
+    assert get_sync_cursor("store-a") == "2025-06-01T11:00:00Z"
+
+
+def test_cursor_holds_at_the_first_failed_receipt(database):
+    save_product_mapping("1", "A1", "syrve-1")
+    receipts = [receipt("r1", "2025-06-01T10:00:00Z"), receipt("r2", "2025-06-01T11:00:00Z"), receipt("r3", "2025-06-01T12:00:00Z")]
+
+    make_bridge(receipts, failing={"r2", "r3"}).sync_last_receipts()
+    assert get_sync_cursor("store-a") == "2025-06-01T11:00:00Z"
+
+    # The next run re-reads from the failed receipt and skips the one already stored
+    bridge = make_bridge(receipts)
+    bridge.sync_last_receipts()
+    assert sorted(bridge.submitted) == ["r2", "r3"]
+    assert get_sync_cursor("store-a") == "2025-06-01T12:00:00Z"
+
+
+def test_unmatched_receipts_are_reported_with_the_command_that_syncs_them(database, capsys):
+    make_bridge([receipt("r1", "2025-06-01T10:00:00Z", product_id="9")]).sync_last_receipts()
+
+    assert get_sync_cursor("store-a") == "2025-06-01T10:00:00Z"
+    assert "map their products, then sync them with `main.py sync --tenants --full-backfill`" in capsys.readouterr().out
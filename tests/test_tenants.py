@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+import services.TenantScheduler as tenant_scheduler
+from services.TenantScheduler import load_tenants
+
+
+def tenant(name, phone_number):
+    return {
+        "name": name,
+        "smartkasa": {"phone_number": phone_number, "password": "secret", "api_key": "key"},
+        "syrve": {"api_login": "login"}
+    }
+
+
+def write_registry(tmp_path, tenants):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps(tenants), encoding="utf-8")
+    return str(path)
+
+
+def test_tenants_may_share_a_syrve_login(tmp_path):
+    tenants = [tenant("store-1", "+380000000001"), tenant("store-2", "+380000000002")]
+    assert load_tenants(write_registry(tmp_path, tenants)) == tenants
+
+
+def test_tenants_sharing_a_smartkasa_login_are_rejected(tmp_path):
+    path = write_registry(tmp_path, [tenant("store-1", "+380000000001"), tenant("store-2", "+380000000001")])
+    with pytest.raises(ValueError, match="SmartKasa login"):
+        load_tenants(path)
+
+
+def test_tenant_names_must_be_unique(tmp_path):
+    path = write_registry(tmp_path, [tenant("store-1", "+380000000001"), tenant("store-1", "+380000000002")])
+    with pytest.raises(ValueError, match="unique name"):
+        load_tenants(path)
+
+
+def test_registry_defaults_to_sync_tenants_file(tmp_path, monkeypatch):
+    tenants = [tenant("a", "380000000001")]
+    monkeypatch.setattr(tenant_scheduler, "SYNC_TENANTS_FILE", write_registry(tmp_path, tenants))
+
+    assert load_tenants() == tenants
@@ -0,0 +1,36 @@
+import time
+from types import SimpleNamespace
+
+from core.tokens import AccessToken
+
+
+def rejected(authorization):
+    return SimpleNamespace(request=SimpleNamespace(headers={"Authorization": authorization} if authorization else {}))
+
+
+def login():
+    tokens = iter(["t1", "t2", "t3"])
+    return lambda: next(tokens)
+
+
+def test_ensure_authenticates_only_near_expiry():
+    token = AccessToken(login(), default_ttl=3600, refresh_margin=300)
+
+    assert token.ensure() is True
+    assert token.ensure() is False
+    assert token.header() == {"Authorization": "Bearer t1"}
+
+    token.expires_at = time.time() + 60
+    assert token.ensure() is True
+    assert token.value == "t2"
+
+
+def test_401_refreshes_only_the_rejected_token():
+    token = AccessToken(login(), default_ttl=3600)
+    token.ensure()
+
+    token.on_unauthorized(rejected("Bearer t1"))
+    assert token.value == "t2"
+    # Another worker's request still carried t1: the token was already replaced
+    token.on_unauthorized(rejected("Bearer t1"))
+    assert token.value == "t2"